@@ -24,7 +24,8 @@ supported_formats = {'csv': 'csv',
                      'wos-plaintext': 'txt',
                      'group-bys-csv': 'csv',
                      'ris': 'ris',
-                     'zip': 'zip'}
+                     'zip': 'zip',
+                     'bib': 'bib'}
 
 s3_key_formats = {}
 
@@ -45,6 +46,111 @@ app.config['SQLALCHEMY_ECHO'] = (os.getenv('SQLALCHEMY_ECHO', False) == 'True')
 
 slice_and_dice_api = os.getenv('SLICE_AND_DICE_API_URL')
 
+# write CSV exports page by page instead of building one DataFrame
+csv_streaming = (os.getenv('CSV_STREAMING', False) == 'True')
+
+# exports each export_worker process runs at once on threads; per-process limits
+# such as DATAFRAME_MEMORY_BUDGET_MB and ZIP_COMPRESSION_WORKERS are split between them
+export_jobs_per_worker = max(int(os.getenv('EXPORT_JOBS_PER_WORKER', 1)), 1)
+
+# page chunks an export_worker process holds in memory in build_dataframes before
+# spilling to disk, as each of its jobs' share
+dataframe_memory_budget = int(os.getenv('DATAFRAME_MEMORY_BUDGET_MB', 512)) * 1024 * 1024 \
+    // export_jobs_per_worker
+
+# pages fetched ahead of the renderer by paginate; 0 fetches serially
+paginate_prefetch_pages = int(os.getenv('PAGINATE_PREFETCH_PAGES', 2))
+
+# large async exports are split into up to this many publication_year shards
+export_max_shards = int(os.getenv('EXPORT_MAX_SHARDS', 4))
+export_shard_min_results = int(os.getenv('EXPORT_SHARD_MIN_RESULTS', 10_000))
+
+# OpenAlex requests per second shared by every export process on the host
+openalex_rate_limit = float(os.getenv('OPENALEX_RATE_LIMIT', 10))
+openalex_rate_burst = int(os.getenv('OPENALEX_RATE_BURST', 10))
+openalex_rate_limit_file = os.getenv('OPENALEX_RATE_LIMIT_FILE', '/tmp/openalex-rate-limit')
+# the web workers' own budget, so exports and user-facing requests don't wait on each other
+openalex_web_rate_limit = float(os.getenv('OPENALEX_WEB_RATE_LIMIT', 10))
+openalex_web_rate_burst = int(os.getenv('OPENALEX_WEB_RATE_BURST', 20))
+openalex_web_rate_limit_file = os.getenv('OPENALEX_WEB_RATE_LIMIT_FILE',
+                                         '/tmp/openalex-web-rate-limit')
+
+# paginate saves a resumable checkpoint every this many pages
+export_checkpoint_pages = int(os.getenv('EXPORT_CHECKPOINT_PAGES', 10))
+# running exports with a checkpoint and no progress for this long are re-claimed
+export_stale_minutes = int(os.getenv('EXPORT_STALE_MINUTES', 10))
+
+# progress is written at most every PROGRESS_MIN_INTERVAL seconds once it has
+# moved PROGRESS_MIN_DELTA, and at least every PROGRESS_HEARTBEAT seconds
+progress_min_interval = float(os.getenv('PROGRESS_MIN_INTERVAL', 5))
+progress_min_delta = float(os.getenv('PROGRESS_MIN_DELTA', 0.02))
+progress_heartbeat = float(os.getenv('PROGRESS_HEARTBEAT', 30))
+
+
+# exports of up to this many results are in the small lane, and any export
+# waiting longer than the aging time is claimed ahead of newer large ones
+export_small_lane_max = int(os.getenv('EXPORT_SMALL_LANE_MAX', 5_000))
+export_lane_aging_minutes = int(os.getenv('EXPORT_LANE_AGING_MINUTES', 30))
+# 'small' or 'large' to only claim that lane's exports, 'any' for both
+export_worker_lane = os.getenv('EXPORT_WORKER_LANE', 'any')
+# threads of a concurrent worker that large exports may not take
+export_small_lane_slots = int(os.getenv('EXPORT_SMALL_LANE_SLOTS', 1))
+
+# a finished export is handed out again for an identical request this long
+export_reuse_minutes = int(os.getenv('EXPORT_REUSE_MINUTES', 15))
+
+# raw OpenAlex pages are cached ('disk', 's3' or '' for off) so other formats
+# of a recent query are rendered without API calls
+page_cache_backend = os.getenv('PAGE_CACHE', 'disk')
+page_cache_dir = os.getenv('PAGE_CACHE_DIR', '/tmp/openalex-page-cache')
+page_cache_max_bytes = int(os.getenv('PAGE_CACHE_MAX_MB', 2048)) * 1024 * 1024
+page_cache_ttl_minutes = int(os.getenv('PAGE_CACHE_TTL_MINUTES', 60))
+
+# sync exports' rendered first pages, kept in each web worker's memory
+instant_cache_size = int(os.getenv('INSTANT_CACHE_SIZE', 128))
+instant_cache_ttl_seconds = int(os.getenv('INSTANT_CACHE_TTL_SECONDS', 300))
+# submitted queries' meta blocks, shared by the web workers on a host
+validation_cache_dir = os.getenv('VALIDATION_CACHE_DIR', '/tmp/openalex-validation-cache')
+validation_cache_ttl_seconds = int(os.getenv('VALIDATION_CACHE_TTL_SECONDS', 300))
+
+# work JSON for BibTeX, kept in each web worker's memory
+work_cache_size = int(os.getenv('WORK_CACHE_SIZE', 10_000))
+work_cache_ttl_seconds = int(os.getenv('WORK_CACHE_TTL_SECONDS', 3600))
+# the single-work endpoint refetches cached works older than this, so it doesn't
+# serve a work that has since been updated for the whole cache TTL
+single_work_max_age_seconds = int(os.getenv('SINGLE_WORK_MAX_AGE_SECONDS', 60))
+bibtex_batch_max_ids = int(os.getenv('BIBTEX_BATCH_MAX_IDS', 1000))
+
+# sorted group-by results of group-bys-csv exports, shared by the host's workers
+group_by_cache_dir = os.getenv('GROUP_BY_CACHE_DIR', '/tmp/openalex-group-by-cache')
+group_by_cache_max_bytes = int(os.getenv('GROUP_BY_CACHE_MAX_MB', 512)) * 1024 * 1024
+group_by_cache_ttl_minutes = int(os.getenv('GROUP_BY_CACHE_TTL_MINUTES', 360))
+
+# download redirects' presigned URLs are valid, and reused, for this long
+presigned_url_expires_seconds = int(os.getenv('PRESIGNED_URL_EXPIRES_SECONDS', 900))
+
+# workers wake on NOTIFY; this is how often they poll for jobs anyway
+job_poll_interval = float(os.getenv('JOB_POLL_INTERVAL', 30))
+
+# stream async RIS, WOS and streaming CSV output to S3 while it is rendered
+export_s3_streaming = (os.getenv('EXPORT_S3_STREAMING', False) == 'True')
+s3_part_size = max(int(os.getenv('S3_PART_SIZE_MB', 8)), 5) * 1024 * 1024
+# e.g. a local MinIO or moto server for testing
+s3_endpoint_url = os.getenv('S3_ENDPOINT_URL')
+
+# zlib level for ZIP exports (1 is the fast mode) and processes compressing members,
+# split between the jobs an export_worker process runs at once
+zip_compression_level = int(os.getenv('ZIP_COMPRESSION_LEVEL', 6))
+zip_compression_workers = max(
+    int(os.getenv('ZIP_COMPRESSION_WORKERS', os.cpu_count() or 1)) // export_jobs_per_worker, 1)
+
+openalex_connect_timeout = float(os.getenv('OPENALEX_CONNECT_TIMEOUT', 5))
+openalex_read_timeout = float(os.getenv('OPENALEX_READ_TIMEOUT', 60))
+openalex_max_retries = int(os.getenv('OPENALEX_MAX_RETRIES', 5))
+openalex_max_concurrency = int(os.getenv('OPENALEX_MAX_CONCURRENCY', 8))
+# group-by dimensions (and the total count) of a group-bys-csv export fetched at once
+group_by_fetch_workers = max(int(os.getenv('GROUP_BY_FETCH_WORKERS', 6)), 1)
+
 
 class NullPoolSQLAlchemy(SQLAlchemy):
     def apply_driver_hacks(self, flask_app, info, options):
@@ -0,0 +1,95 @@
+"""
+Compares abstract reconstruction on abstract-heavy pages: the old
+json_normalize + row-wise apply path (CSV/ZIP) and dict-sort path (RIS)
+against formats.abstracts.
+
+Usage:
+  python -m benchmarks.abstract_benchmark
+"""
+
+import random
+import time
+
+import pandas as pd
+
+from formats.abstracts import reconstruct_abstract, split_abstracts
+
+PER_PAGE = 200
+ABSTRACT_WORDS = 250
+VOCABULARY = [f'word{i}' for i in range(5000)]
+
+
+def make_page():
+    page = []
+    for i in range(PER_PAGE):
+        inverted_index = {}
+        for position in range(ABSTRACT_WORDS):
+            inverted_index.setdefault(random.choice(VOCABULARY), []).append(position)
+        page.append({
+            'id': f'https://openalex.org/W{i}',
+            'open_access': {'is_oa': True},
+            'abstract_inverted_index': inverted_index,
+        })
+    return page
+
+
+def old_reconstruct_abstract(row, inverted_columns):
+    word_positions = {}
+    for col in inverted_columns:
+        word = col.split('.', maxsplit=1)[-1]
+        indexes = row[col]
+        if not isinstance(indexes, list):
+            continue
+        for index in indexes:
+            word_positions[index] = word
+    max_index = max(word_positions.keys(), default=-1)
+    abstract = [word_positions.get(i, '') for i in range(max_index + 1)]
+    return ' '.join(abstract)
+
+
+def old_unravel_index(inverted_index):
+    unraveled = {}
+    for key, values in inverted_index.items():
+        for value in values:
+            unraveled[value] = key
+    sorted_unraveled = dict(sorted(unraveled.items()))
+    return " ".join(sorted_unraveled.values()).replace("\n", "")
+
+
+def old_dataframe(page):
+    df = pd.json_normalize(page)
+    drop_columns = [col for col in df.columns if 'abstract_inverted' in col]
+    df['abstract'] = df.apply(old_reconstruct_abstract,
+                              inverted_columns=drop_columns, axis=1)
+    return df.drop(columns=drop_columns)
+
+
+def new_dataframe(page):
+    page, abstracts = split_abstracts(page)
+    df = pd.json_normalize(page)
+    df['abstract'] = abstracts
+    return df
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    page = make_page()
+    assert old_dataframe(page)['abstract'].tolist() == new_dataframe(page)['abstract'].tolist()
+
+    old = timed(old_dataframe, page)
+    new = timed(new_dataframe, page)
+    print(f'dataframe page: {old:.3f}s -> {new:.3f}s ({old / new:.0f}x)')
+
+    indexes = [work['abstract_inverted_index'] for work in page]
+    old = timed(lambda: [old_unravel_index(i) for i in indexes])
+    new = timed(lambda: [reconstruct_abstract(i, fill_gaps=False) for i in indexes])
+    print(f'ris page:       {old:.3f}s -> {new:.3f}s ({old / new:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
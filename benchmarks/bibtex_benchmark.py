@@ -0,0 +1,58 @@
+"""
+Times BibTeX rendering of synthetic works with the streaming entry writer
+against building a BibDatabase and calling bibtexparser.dumps per entry,
+and checks both give the same text.
+
+Usage:
+  python -m benchmarks.bibtex_benchmark
+"""
+
+import random
+import time
+
+from bibtex import dump_bibtex, dump_bibtex_with_bibtexparser
+
+WORKS = 20_000
+TYPES = ['journal-article', 'book', 'book-chapter', 'proceedings-article',
+         'dissertation', 'posted-content', 'dataset']
+
+
+def make_work(i, rng):
+    return {
+        'id': f'https://openalex.org/W{i}',
+        'doi': f'https://doi.org/10.1234/{i}',
+        'type_crossref': rng.choice(TYPES),
+        'title': f'Work {i} on ' + ' '.join(rng.choice(['open', 'alex', 'graph', 'data'])
+                                           for _ in range(8)),
+        'publication_year': rng.randrange(1950, 2025),
+        'authorships': [
+            {'author': {'display_name': f'Author {rng.randrange(10**6)}'},
+             'institutions': [{'display_name': 'University'}]}
+            for _ in range(rng.randrange(1, 8))
+        ],
+        'host_venue': {'display_name': 'Venue', 'publisher': 'Publisher',
+                       'url': f'https://example.org/{i}'},
+        'biblio': {'volume': str(rng.randrange(1, 50)), 'issue': '2',
+                   'first_page': '1', 'last_page': str(rng.randrange(2, 40))},
+    }
+
+
+def main():
+    rng = random.Random(0)
+    works = [make_work(i, rng) for i in range(WORKS)]
+
+    timings = {}
+    outputs = {}
+    for name, dump in [('bibtexparser per entry', dump_bibtex_with_bibtexparser),
+                       ('streaming writer', dump_bibtex)]:
+        start = time.perf_counter()
+        outputs[name] = [dump(work) for work in works]
+        timings[name] = time.perf_counter() - start
+        print(f'{name}: {timings[name]:.2f}s, {WORKS / timings[name]:,.0f} works/s')
+
+    assert outputs['bibtexparser per entry'] == outputs['streaming writer']
+    print(f'identical output, {timings["bibtexparser per entry"] / timings["streaming writer"]:.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Compares the old per-page pd.concat accumulation in build_dataframes with
+DataFrameAccumulator as the number of pages grows.
+
+Usage:
+  python -m benchmarks.concat_benchmark
+"""
+
+import time
+
+import pandas as pd
+
+from formats.accumulator import DataFrameAccumulator
+
+PER_PAGE = 200
+PAGE_COUNTS = [25, 50, 100, 200]
+
+
+def make_page(page_number):
+    return pd.DataFrame([{
+        'id': f'https://openalex.org/W{page_number * PER_PAGE + i}',
+        'display_name': f'work {i} on page {page_number}',
+        'publication_year': 2000 + i % 24,
+        'cited_by_count': i,
+        'open_access.is_oa': i % 2 == 0,
+        'referenced_works': [f'https://openalex.org/W{j}' for j in range(10)],
+    } for i in range(PER_PAGE)])
+
+
+def concat_every_page(pages):
+    df = None
+    for page in pages:
+        df = page if df is None else pd.concat([df, page], axis=0).reset_index(drop=True)
+    return df
+
+
+def accumulate(pages, memory_budget):
+    accumulator = DataFrameAccumulator(memory_budget)
+    for page in pages:
+        accumulator.append(page)
+    return accumulator.materialize()
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    print(f'{"pages":>6} {"concat/page":>12} {"accumulator":>12} {"spilling":>12}')
+    for page_count in PAGE_COUNTS:
+        pages = [make_page(n) for n in range(page_count)]
+        old = timed(concat_every_page, pages)
+        new = timed(accumulate, pages, float('inf'))
+        spilled = timed(accumulate, pages, 16 * 1024 * 1024)
+        print(f'{page_count:>6} {old:>11.2f}s {new:>11.2f}s {spilled:>11.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Checks that StreamingCsvWriter renders the same single-file CSV as
+build_single_df, the same ZIP members as the DataFrame path and the same
+instant (first page) CSV, on pages of works shaped like OpenAlex's, with
+nested dicts, lists of objects, null nested dicts, nullable ints and keys
+that come and go between works and pages, including pages where a column is
+entirely null.
+
+Usage:
+  python -m benchmarks.csv_stream_check
+"""
+
+import copy
+import csv
+import io
+import random
+import tempfile
+from types import SimpleNamespace
+
+import formats.util
+from formats.csv import build_single_df
+from formats.csv_stream import StreamingCsvWriter
+from formats.instant import streaming_csv_chunks
+from formats.util import build_dataframes, join_lists
+
+PER_PAGE = 50
+PAGES = 4
+SEEDS = 10
+# ways a page can leave a column entirely null
+NULL_MODES = ['none', 'no_sources', 'no_counts', 'some_counts_missing',
+              'no_apc_values', 'no_dois', 'no_oa_flags']
+ARGS = [
+    {},
+    {'truncate': True},
+    {'columns': 'id,display_name,ids.doi,authorships.author,open_access.is_oa'},
+]
+
+
+def make_location(rng, n, null_mode):
+    source = rng.choice([None, {'id': f'https://openalex.org/S{n % 7}',
+                                'display_name': f'source {n % 7}',
+                                'issn_l': rng.choice([None, '1234-5678']),
+                                'is_in_doaj': rng.random() < 0.5}])
+    return {
+        'is_oa': None if null_mode == 'no_oa_flags' else rng.random() < 0.5,
+        'landing_page_url': rng.choice([None, f'https://example.org/{n}']),
+        'source': None if null_mode == 'no_sources' else source,
+        'license': rng.choice([None, 'cc-by']),
+        'version': rng.choice([None, 'publishedVersion']),
+    }
+
+
+def make_work(rng, n, null_mode):
+    work = {
+        'id': f'https://openalex.org/W{n}',
+        'doi': rng.choice([f'https://doi.org/10.1/{n}', None]),
+        'title': f'work {n}',
+        'display_name': f'work {n}',
+        'publication_year': rng.choice([2019, 2020, 2021]),
+        'ids': {'openalex': f'https://openalex.org/W{n}',
+                'doi': f'https://doi.org/10.1/{n}'},
+        'primary_location': make_location(rng, n, null_mode),
+        'locations': [make_location(rng, n + i, null_mode)
+                      for i in range(rng.randrange(3))],
+        'type': 'article',
+        'open_access': {'is_oa': rng.random() < 0.5, 'oa_status': 'green',
+                        'oa_url': None},
+        'authorships': [{
+            'author_position': rng.choice(['first', 'middle', 'last']),
+            'author': {'id': f'https://openalex.org/A{n}{i}',
+                       'display_name': f'author {i}',
+                       'orcid': rng.choice([None, f'https://orcid.org/{i}'])},
+            'institutions': [{'id': f'https://openalex.org/I{i}',
+                              'display_name': f'institution {i}',
+                              'lineage': [f'https://openalex.org/I{i}']}],
+            'countries': ['US', 'GB'][:rng.randrange(3)],
+            'is_corresponding': rng.random() < 0.3,
+            'raw_affiliation_strings': ['somewhere'],
+        } for i in range(rng.randrange(4))],
+        'cited_by_count': rng.randrange(100),
+        'biblio': {'volume': rng.choice([None, '12']), 'issue': None,
+                   'first_page': '1', 'last_page': '9'},
+        'is_retracted': False,
+        'referenced_works': [f'https://openalex.org/W{j}' for j in
+                             range(rng.randrange(3))],
+        'abstract_inverted_index': rng.choice([None, {'an': [0], 'abstract': [1]}]),
+        'updated_date': '2024-01-01T00:00:00',
+    }
+    if rng.random() < 0.2:
+        work['apc_paid'] = {
+            'value': None if null_mode == 'no_apc_values' else
+            rng.choice([None, rng.randrange(3000)]),
+            'currency': 'USD'}
+    if rng.random() < 0.2:
+        del work['biblio']
+    if null_mode == 'no_counts':
+        work['cited_by_count'] = None
+    elif null_mode == 'some_counts_missing':
+        if rng.random() < 0.5:
+            del work['cited_by_count']
+        else:
+            work['cited_by_count'] = None
+    if null_mode == 'no_dois':
+        work['doi'] = None
+    return work
+
+
+def make_pages(seed):
+    rng = random.Random(seed)
+    pages = []
+    for page in range(PAGES):
+        null_mode = rng.choice(NULL_MODES)
+        pages.append([make_work(rng, page * PER_PAGE + i, null_mode)
+                      for i in range(PER_PAGE)])
+    return pages
+
+
+def dataframe_outputs(pages, args):
+    export = SimpleNamespace(args=args)
+    formats.util.paginate = lambda *a, **k: iter(copy.deepcopy(pages))
+    single = build_single_df(export).to_csv(index=False)
+    tables = {name: df.applymap(join_lists).to_csv(index=False)
+              for name, df in build_dataframes(export).items()}
+    return single, tables
+
+
+def streaming_outputs(pages, args):
+    with tempfile.TemporaryFile('w+') as spool:
+        writer = StreamingCsvWriter(args, spool)
+        for page in copy.deepcopy(pages):
+            writer.add_page(page)
+
+        def render(write):
+            spool.seek(0)
+            out = io.StringIO()
+            write(spool, out)
+            return out.getvalue()
+
+        single = render(writer.write_csv)
+        tables = {name: render(write) for name, write in writer.tables()}
+    return single, tables
+
+
+def first_difference(expected, actual):
+    expected_rows = list(csv.reader(io.StringIO(expected)))
+    actual_rows = list(csv.reader(io.StringIO(actual)))
+    header = expected_rows[0] if expected_rows else []
+    for n, (a, b) in enumerate(zip(expected_rows, actual_rows)):
+        for i, (x, y) in enumerate(zip(a, b)):
+            if x != y:
+                column = header[i] if n and i < len(header) else i
+                return f'line {n}, column {column}: dataframe {x!r}, streaming {y!r}'
+        if len(a) != len(b):
+            return f'line {n}: {len(a)} cells, streaming {len(b)}'
+    if expected.count('\n') != actual.count('\n'):
+        return 'line counts differ'
+    return 'line endings or quoting'
+
+
+def main():
+    failures = 0
+    for seed in range(SEEDS):
+        pages = make_pages(seed)
+        for args in ARGS:
+            expected_single, expected_tables = dataframe_outputs(pages, args)
+            single, tables = streaming_outputs(pages, args)
+            outputs = [('csv', expected_single, single)] + [
+                (f'{name}.csv', expected_tables.get(name, ''), tables.get(name, ''))
+                for name in dict.fromkeys(list(expected_tables) + list(tables))]
+            expected_instant, _ = dataframe_outputs(pages[:1], args)
+            instant = streaming_csv_chunks(args, copy.deepcopy(pages[0]))
+            outputs.append(('instant csv', expected_instant, ''.join(instant)))
+            for name, expected, actual in outputs:
+                if expected != actual:
+                    failures += 1
+                    print(f'seed {seed} {args} {name} differs at '
+                          f'{first_difference(expected, actual)}')
+    print('ok' if not failures else f'{failures} mismatches')
+    return failures
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
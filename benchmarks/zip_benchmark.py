@@ -0,0 +1,50 @@
+"""
+Times ZIP export compression of several CSV members on one core versus a
+process per member, at the fast and default compression levels.
+
+Usage:
+  python -m benchmarks.zip_benchmark
+"""
+
+import csv
+import os
+import random
+import tempfile
+import time
+from functools import partial
+
+from formats.zip_writer import write_zip
+
+MEMBERS = ['works', 'authorships', 'locations', 'topics', 'concepts', 'grants']
+ROWS = 200_000
+
+
+def write_member(seed, text_file):
+    rng = random.Random(seed)
+    writer = csv.writer(text_file, lineterminator='\n')
+    writer.writerow(['id', 'work_id', 'display_name', 'score'])
+    for i in range(ROWS):
+        writer.writerow([f'https://openalex.org/A{rng.randrange(10**9)}',
+                         f'https://openalex.org/W{i}',
+                         ' '.join(rng.choice(['open', 'alex', 'data', 'work', 'export'])
+                                  for _ in range(6)),
+                         rng.random()])
+
+
+def main():
+    members = [(f'{name}.csv', partial(write_member, seed))
+               for seed, name in enumerate(MEMBERS)]
+    workers = os.cpu_count() or 1
+    zip_filename = tempfile.mkstemp(suffix='.zip')[1]
+    print(f'{len(MEMBERS)} members x {ROWS} rows, {workers} cpus')
+    for level in [1, 6]:
+        for n in [1, workers]:
+            start = time.perf_counter()
+            write_zip(zip_filename, members, level=level, workers=n)
+            print(f'level {level}, {n} workers: {time.perf_counter() - start:.2f}s, '
+                  f'{os.path.getsize(zip_filename) / 1e6:.1f} MB')
+    os.remove(zip_filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -35,7 +35,24 @@ entry_type_by_crossref_type = {
 
 
 def dump_bibtex(work):
-    entry_type = entry_type_by_crossref_type.get(work.get('type'))
+    if not (entry := build_bibtex_entry(work)):
+        return None
+    return format_bibtex_entry(entry)
+
+
+def dump_bibtex_with_bibtexparser(work):
+    """dump_bibtex through a BibDatabase, as it used to be, for comparison."""
+    if not (entry := build_bibtex_entry(work)):
+        return None
+    bib_db = BibDatabase()
+    bib_db.entries.append(entry)
+    return bibtexparser.dumps(bib_db)
+
+
+def build_bibtex_entry(work):
+    # works carry the Crossref type alongside OpenAlex's own type
+    entry_type = entry_type_by_crossref_type.get(
+        work.get('type_crossref') or work.get('type'))
     work_id = work.get('id')
 
     if not (entry_type and work_id):
@@ -50,11 +67,22 @@ def dump_bibtex(work):
     if doi := work.get('doi'):
         entry['doi'] = doi.replace('https://doi.org/', '')
 
-    bib_db = BibDatabase()
     _populate_entry(entry, work)
-
-    bib_db.entries.append(entry)
-    return bibtexparser.dumps(bib_db)
+    return entry
+
+
+def format_bibtex_entry(entry):
+    """
+    The entry as bibtexparser's default BibTexWriter writes it, with fields
+    in alphabetical order, without building a BibDatabase for it.
+    """
+    parts = ['@', entry['ENTRYTYPE'], '{', entry['ID']]
+    for field in sorted(entry):
+        if field in ('ENTRYTYPE', 'ID'):
+            continue
+        parts.extend((',\n ', field, ' = {', entry[field], '}'))
+    parts.append('\n}\n\n')
+    return ''.join(parts)
 
 
 def _populate_entry(entry, work):
@@ -1,12 +1,13 @@
 import datetime
 import os
-from time import sleep, time
+from time import time
 
 import sentry_sdk
 from sqlalchemy import text
 
 from app import app
-from app import db, logger, EXPORT_EMAIL_TABLE, EXPORT_TABLE
+from app import db, logger, EXPORT_EMAIL_TABLE, EXPORT_TABLE, job_poll_interval
+from job_events import EXPORT_FINISHED_CHANNEL, JobListener
 from models import Export, ExportEmail
 from emailer import send_email
 from util import elapsed
@@ -15,6 +16,7 @@ sentry_sdk.init(dsn=os.environ.get('SENTRY_DSN'),)
 
 
 def worker_run():
+    listener = JobListener(EXPORT_FINISHED_CHANNEL)
     while True:
         if email_request_id := fetch_email_request_id():
             if not (email_request := ExportEmail.query.get(email_request_id)):
@@ -30,7 +32,7 @@ def worker_run():
             db.session.merge(email_request)
             db.session.commit()
         else:
-            sleep(5)
+            listener.wait(job_poll_interval)
 
 
 def email_result_link(export, email):
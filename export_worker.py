@@ -1,20 +1,31 @@
 import datetime
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from time import sleep, time
 
-import boto3
 import sentry_sdk
 from sqlalchemy import text
 
-from app import app, supported_formats
+from app import app
 from app import app_url
 from app import db, logger
-from app import EXPORT_TABLE
+from app import EXPORT_TABLE, export_stale_minutes, job_poll_interval, \
+    export_jobs_per_worker, export_small_lane_max, export_lane_aging_minutes, \
+    export_worker_lane, export_small_lane_slots
+from formats.bib import export_bib
 from formats.csv import export_csv
 from formats.group_bys import export_group_bys_csv
+from formats.multi import export_multi
+from formats.progress import ExportHeartbeat
 from formats.ris import export_ris
+from formats.s3 import EXPORT_BUCKET, EXPORT_CONTENT_TYPES, export_s3_key, \
+    get_s3_client
 from formats.wos_plaintext import export_wos
 from formats.zip import export_zip
+from job_events import EXPORT_FINISHED_CHANNEL, EXPORT_SUBMITTED_CHANNEL, \
+    JobListener, notify
 from models import Export
 
 from util import elapsed
@@ -23,93 +34,207 @@ sentry_sdk.init(dsn=os.environ.get('SENTRY_DSN'),)
 
 
 def worker_run():
+    if export_jobs_per_worker > 1:
+        return concurrent_worker_run(export_jobs_per_worker)
+
+    listener = JobListener(EXPORT_SUBMITTED_CHANNEL)
     while True:
-        export_id = None
-        job_start_time = None
         try:
-            if export_id := fetch_export_id():
-                job_start_time = time()
-
-                if not (export := Export.query.get(export_id)):
-                    # not sure how this happened, but not much we can do
-                    logger.error(f'export {export_id} not found in database')
-                    continue
-
-                logger.info(f'processing export {export_id} (format: {export.format})')
-
-                if export.format == 'csv':
-                    filename = export_csv(export)
-                elif export.format == 'wos-plaintext':
-                    filename = export_wos(export)
-                elif export.format == "group-bys-csv":
-                    filename = export_group_bys_csv(export)
-                elif export.format == 'ris':
-                    filename = export_ris(export)
-                elif export.format == "zip":
-                    filename = export_zip(export)
-                else:
-                    raise ValueError(f'unknown format {export.format}')
-
-                if not filename.startswith('s3://'):
-                    file_format = supported_formats[export.format]
-                    s3_client = boto3.client('s3')
-                    s3_client.upload_file(filename, 'openalex-query-exports', f'{export_id}.{file_format}')
-                    s3_object_name = f's3://openalex-query-exports/{export_id}.{file_format}'
-
-                    # Clean up temp file after upload
-                    try:
-                        os.remove(filename)
-                        logger.info(f'cleaned up temp file {filename}')
-                    except Exception as cleanup_error:
-                        logger.warning(f'failed to clean up temp file {filename}: {cleanup_error}')
-                else:
-                    s3_object_name = filename
-
-                logger.info(f'uploaded {filename} to {s3_object_name}')
-                export.result_url = f'{app_url}/export/{export.id}/download'
-                export.status = 'finished'
-                export.progress = 1
-                export.progress_updated = datetime.datetime.utcnow()
-                db.session.merge(export)
-                db.session.commit()
-
-                # Log successful completion with timing
-                total_time = elapsed(job_start_time) if job_start_time else 'unknown'
-                logger.info(f'successfully completed export {export_id} in {total_time} seconds')
+            if fetched := fetch_export():
+                process_export(fetched[0])
             else:
-                sleep(1)
+                listener.wait(job_poll_interval)
         except Exception as e:
-            logger.error(f'error processing export {export_id}: {e}', exc_info=True)
+            logger.error(f'error fetching export: {e}', exc_info=True)
             sentry_sdk.capture_exception(e)
-
-            # Mark the job as failed so it doesn't stay stuck in 'running'
-            if export_id:
-                try:
-                    export = Export.query.get(export_id)
-                    if export:
-                        export.status = 'failed'
-                        export.progress_updated = datetime.datetime.utcnow()
-                        db.session.merge(export)
-                        db.session.commit()
-                        logger.info(f'marked export {export_id} as failed')
-                except Exception as inner_e:
-                    logger.error(f'error marking export {export_id} as failed: {inner_e}')
-                    sentry_sdk.capture_exception(inner_e)
-
-            # Continue processing other jobs instead of crashing
             sleep(1)
 
+
+def concurrent_worker_run(max_jobs):
+    """
+    Runs up to max_jobs exports at once on threads of this process, which
+    spend most of their time waiting on OpenAlex and S3. A new job is only
+    claimed when a thread is free. Each job has its own app context, and so
+    its own session, and a failing export only fails itself. In the 'any'
+    lane, export_small_lane_slots threads are kept for small exports, and a
+    finished export wakes the loop to give its large slot to a waiting one.
+    """
+    listener = JobListener(EXPORT_SUBMITTED_CHANNEL, EXPORT_FINISHED_CHANNEL)
+    free_slots = threading.BoundedSemaphore(max_jobs)
+    large_slots = None
+    if export_worker_lane == 'any':
+        large_slots = threading.BoundedSemaphore(
+            max(max_jobs - export_small_lane_slots, 1))
+    with ThreadPoolExecutor(max_workers=max_jobs,
+                            thread_name_prefix='export') as pool:
+        while True:
+            free_slots.acquire()
+            lane = export_worker_lane
+            holds_large_slot = False
+            if large_slots is not None:
+                holds_large_slot = large_slots.acquire(blocking=False)
+                if not holds_large_slot:
+                    lane = 'small'
+
+            try:
+                fetched = fetch_export(lane)
+            except Exception as e:
+                fetched = None
+                logger.error(f'error fetching export: {e}', exc_info=True)
+                sentry_sdk.capture_exception(e)
+
+            if holds_large_slot and (not fetched or fetched[1]):
+                large_slots.release()
+                holds_large_slot = False
+
+            if not fetched:
+                free_slots.release()
+                listener.wait(job_poll_interval)
+                continue
+
+            job = pool.submit(process_export_in_app_context, fetched[0])
+            job.add_done_callback(
+                partial(release_slots, free_slots,
+                        large_slots if holds_large_slot else None))
+
+
+def release_slots(free_slots, large_slots, _):
+    free_slots.release()
+    if large_slots is not None:
+        large_slots.release()
+
+
+def process_export_in_app_context(export_id):
+    # the app context is torn down with its scoped session when the job ends
+    with app.app_context():
+        process_export(export_id)
+
+
+def upload_output(export, export_format, filename):
+    """
+    Uploads a format's output file unless it was streamed to S3 already, and
+    returns what the download endpoint needs to know about the object.
+    """
+    if not filename.startswith('s3://'):
+        s3_key = export_s3_key(export, export_format)
+        size = os.path.getsize(filename)
+        get_s3_client().upload_file(filename, EXPORT_BUCKET, s3_key)
+        s3_object_name = f's3://{EXPORT_BUCKET}/{s3_key}'
+
+        # Clean up temp file after upload
+        try:
+            os.remove(filename)
+            logger.info(f'cleaned up temp file {filename}')
+        except Exception as cleanup_error:
+            logger.warning(f'failed to clean up temp file {filename}: {cleanup_error}')
+    else:
+        s3_object_name = filename
+        s3_key = filename[len(f's3://{EXPORT_BUCKET}/'):]
+        size = get_s3_client().head_object(Bucket=EXPORT_BUCKET,
+                                           Key=s3_key)['ContentLength']
+
+    logger.info(f'uploaded {filename} to {s3_object_name}')
+    return {'key': s3_key, 'size': size,
+            'content_type': EXPORT_CONTENT_TYPES[export_format]}
+
+
+def process_export(export_id):
+    job_start_time = time()
+    try:
+        if not (export := Export.query.get(export_id)):
+            # not sure how this happened, but not much we can do
+            logger.error(f'export {export_id} not found in database')
+            return
+
+        logger.info(f'processing export {export_id} (format: {export.format})')
+
+        # paginate reports progress itself, but rendering and uploading can outlast
+        # export_stale_minutes
+        with ExportHeartbeat(export):
+            if len(export.formats) > 1:
+                filenames = export_multi(export)
+            elif export.format == 'csv':
+                filenames = {export.format: export_csv(export)}
+            elif export.format == 'wos-plaintext':
+                filenames = {export.format: export_wos(export)}
+            elif export.format == "group-bys-csv":
+                filenames = {export.format: export_group_bys_csv(export)}
+            elif export.format == 'ris':
+                filenames = {export.format: export_ris(export)}
+            elif export.format == "zip":
+                filenames = {export.format: export_zip(export)}
+            elif export.format == 'bib':
+                filenames = {export.format: export_bib(export)}
+            else:
+                raise ValueError(f'unknown format {export.format}')
+
+            export.outputs = {
+                export_format: upload_output(export, export_format, filename)
+                for export_format, filename in filenames.items()
+            }
+
+        export.result_url = f'{app_url}/export/{export.id}/download'
+        export.status = 'finished'
+        export.progress = 1
+        export.checkpoint = None
+        export.progress_updated = datetime.datetime.utcnow()
+        db.session.merge(export)
+        notify(EXPORT_FINISHED_CHANNEL, export.id)
+        db.session.commit()
+
+        # Log successful completion with timing
+        logger.info(f'successfully completed export {export_id} in {elapsed(job_start_time)} seconds')
+    except Exception as e:
+        logger.error(f'error processing export {export_id}: {e}', exc_info=True)
+        sentry_sdk.capture_exception(e)
+
+        # Mark the job as failed so it doesn't stay stuck in 'running'
+        try:
+            db.session.rollback()
+            export = Export.query.get(export_id)
+            if export:
+                export.status = 'failed'
+                export.progress_updated = datetime.datetime.utcnow()
+                db.session.merge(export)
+                db.session.commit()
+                logger.info(f'marked export {export_id} as failed')
+        except Exception as inner_e:
+            logger.error(f'error marking export {export_id} as failed: {inner_e}')
+            sentry_sdk.capture_exception(inner_e)
+
+
 last_log_time = 0
-def fetch_export_id():
+def fetch_export(lane=export_worker_lane):
+    """
+    Claims the next export in lane ('small', 'large' or 'any') and returns
+    (export_id, is_small), or None when there is nothing to do. Small exports
+    go first, and large ones join them in submission order once they have
+    waited export_lane_aging_minutes. Exports with no result_count, such as
+    group-bys-csv ones that skip the count, are of unknown size and go large.
+    """
     global last_log_time
     last_log_time = time() if time() - last_log_time >= 60 and logger.info("looking for jobs to process") is None else last_log_time
 
     fetch_query = text(f"""
         with fetched_export as (
-            select id
+            select id, coalesce(result_count <= :small_max, false) as is_small
             from """ + EXPORT_TABLE + """
-            where status = 'submitted'
-            order by submitted
+            where (
+                status = 'submitted'
+                -- a checkpointed export whose worker died, to be resumed
+                or (
+                    status = 'running'
+                    -- rows cleared before checkpoint stored None as SQL NULL hold JSON null
+                    and jsonb_typeof(checkpoint) = 'object'
+                    and progress_updated < now() - make_interval(mins => :stale_minutes)
+                )
+            )
+            and (:lane = 'any' or (:lane = 'small') = coalesce(result_count <= :small_max, false))
+            order by
+                case when coalesce(result_count <= :small_max, false)
+                        or submitted < now() - make_interval(mins => :aging_minutes)
+                    then 0 else 1 end,
+                submitted
             limit 1
             for update skip locked
         )
@@ -117,18 +242,23 @@ def fetch_export_id():
         set status = 'running', progress_updated = now()
         from fetched_export
         where """ + EXPORT_TABLE + """.id = fetched_export.id
-        returning fetched_export.id;
+        returning fetched_export.id, fetched_export.is_small;
     """)
 
     job_time = time()
     with db.engine.begin() as connection:
-        result = connection.execute(fetch_query)
-        export_id = result.scalar()
-
-    if export_id:
-        logger.info(f'fetched export {export_id}, took {elapsed(job_time)} seconds')
+        result = connection.execute(fetch_query, {
+            'stale_minutes': export_stale_minutes,
+            'small_max': export_small_lane_max,
+            'aging_minutes': export_lane_aging_minutes,
+            'lane': lane,
+        })
+        fetched = result.first()
 
-    return export_id
+    if fetched:
+        logger.info(f'fetched export {fetched[0]} ({"small" if fetched[1] else "large"}), took {elapsed(job_time)} seconds')
+        return tuple(fetched)
+    return None
 
 
 if __name__ == "__main__":
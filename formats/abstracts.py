@@ -0,0 +1,48 @@
+ABSTRACT_INDEX_KEY = 'abstract_inverted_index'
+
+
+def reconstruct_abstract(inverted_index, fill_gaps=True):
+    """
+    Rebuild abstract text from an OpenAlex abstract_inverted_index in one pass
+    over its positions. Missing positions become empty words when fill_gaps is
+    set (as in the CSV exports) and are skipped otherwise (as in RIS).
+    """
+    if not isinstance(inverted_index, dict):
+        return ''
+    words = []
+    for word, positions in inverted_index.items():
+        if not isinstance(positions, list):
+            continue
+        for position in positions:
+            if position >= len(words):
+                words.extend([None] * (position + 1 - len(words)))
+            words[position] = word
+    if fill_gaps:
+        return ' '.join(word if word is not None else '' for word in words)
+    return ' '.join(word for word in words if word is not None)
+
+
+def has_oa_flag(works):
+    return any(isinstance(work.get('open_access'), dict) and
+               'is_oa' in work['open_access'] for work in works)
+
+
+def is_oa(work):
+    return bool((work.get('open_access') or {}).get('is_oa'))
+
+
+def split_abstracts(works):
+    """
+    Returns copies of works without abstract_inverted_index, so the index is
+    never flattened into one column per word, plus each work's abstract ('' for
+    closed access works).
+    """
+    stripped = []
+    abstracts = []
+    for work in works:
+        inverted_index = work.get(ABSTRACT_INDEX_KEY)
+        stripped.append({k: v for k, v in work.items() if
+                         k != ABSTRACT_INDEX_KEY})
+        abstracts.append(
+            reconstruct_abstract(inverted_index) if is_oa(work) else '')
+    return stripped, abstracts
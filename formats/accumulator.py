@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+
+class DataFrameAccumulator:
+    """
+    Collects page DataFrames as chunks and concatenates them once at the end,
+    instead of re-concatenating everything accumulated so far on every page.
+    When the chunks held in memory exceed memory_budget bytes they are spilled
+    to a scratch directory and read back in order by materialize().
+    """
+
+    def __init__(self, memory_budget, scratch_dir=None):
+        self.memory_budget = memory_budget
+        self.scratch_dir = scratch_dir
+        self._chunks = []
+        self._memory_used = 0
+        self._spill_dir = None
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def append(self, df):
+        self._chunks.append(df)
+        self._memory_used += df.memory_usage(index=True, deep=True).sum()
+        if self._memory_used > self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix='export-chunks-',
+                                               dir=self.scratch_dir)
+        for i, chunk in enumerate(self._chunks):
+            if isinstance(chunk, pd.DataFrame):
+                path = os.path.join(self._spill_dir, f'{i:06d}.pkl')
+                chunk.to_pickle(path)
+                self._chunks[i] = path
+        self._memory_used = 0
+
+    def materialize(self, drop_columns=None):
+        frames = []
+        for chunk in self._chunks:
+            df = pd.read_pickle(chunk) if isinstance(chunk, str) else chunk
+            if drop_columns:
+                df = df.drop(columns=[c for c in drop_columns if c in df.columns])
+            frames.append(df)
+        self.cleanup()
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=0, ignore_index=True)
+
+    def cleanup(self):
+        self._chunks = []
+        self._memory_used = 0
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
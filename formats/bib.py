@@ -0,0 +1,23 @@
+from bibtex import dump_bibtex
+from formats.s3 import streaming_s3_key
+from formats.util import paginate, open_partial_output, output_location
+
+
+def bib_entries(page):
+    for work in page:
+        # works of types BibTeX has no entry for are left out
+        if entry := dump_bibtex(work):
+            yield entry
+
+
+def write_bib_page(f, page):
+    for entry in bib_entries(page):
+        f.write(entry)
+
+
+def export_bib(export):
+    f, _ = open_partial_output(export, '.bib', streaming_s3_key(export))
+    with f:
+        for page in paginate(export, f.name, output=f):
+            write_bib_page(f, page)
+    return output_location(f)
@@ -0,0 +1,240 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app import logger, openalex_connect_timeout, openalex_read_timeout, \
+    openalex_max_retries, openalex_max_concurrency
+from formats.rate_limit import openalex_rate_limiter, web_rate_limiter
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_BACKOFF_SECONDS = 60
+TARGET_LATENCY_SECONDS = 5
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN_SECONDS = 30
+
+
+class OpenAlexError(requests.exceptions.RequestException):
+    pass
+
+
+class AimdLimit:
+    """
+    A value between floor and ceiling that grows additively while requests go
+    well and shrinks multiplicatively when they are slow or fail.
+    """
+
+    def __init__(self, initial, floor, ceiling, increase=1, decrease=0.5):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.increase = increase
+        self.decrease = decrease
+        self._value = initial
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        return int(self._value)
+
+    def on_success(self):
+        with self._lock:
+            self._value = min(self.ceiling, self._value + self.increase)
+
+    def on_failure(self):
+        with self._lock:
+            self._value = max(self.floor, self._value * self.decrease)
+
+    def observe(self, latency, ok=True):
+        if ok and latency <= TARGET_LATENCY_SECONDS:
+            self.on_success()
+        else:
+            self.on_failure()
+
+
+class AdaptiveConcurrency(AimdLimit):
+    """AimdLimit on the number of requests this process has in flight."""
+
+    def __init__(self, ceiling):
+        super().__init__(ceiling, 1, ceiling)
+        self._in_flight = 0
+        self._slot_freed = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._slot_freed:
+            while self._in_flight >= self.value:
+                self._slot_freed.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._slot_freed:
+                self._in_flight -= 1
+                self._slot_freed.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Holds calls back for a cooldown period after too many consecutive
+    failures, then lets a single trial call through before closing again.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def wait(self, block=True):
+        """
+        Blocks while the breaker is open, until the cooldown has passed and no
+        other call is on trial. Raises OpenAlexError instead when not block.
+        """
+        while True:
+            with self._lock:
+                if self._opened_at is None:
+                    return
+                remaining = self.cooldown - (time.time() - self._opened_at)
+                if remaining <= 0 and not self._trial_running:
+                    self._trial_running = True
+                    return
+            if not block:
+                raise OpenAlexError('OpenAlex API circuit breaker is open')
+            time.sleep(remaining if remaining > 0 else 1)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def end_trial(self):
+        """Ends a trial call without counting towards or resetting failures."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._failures >= self.threshold:
+                if self._opened_at is None:
+                    logger.warning('opening OpenAlex API circuit breaker')
+                self._opened_at = time.time()
+
+
+def retry_after_seconds(response):
+    value = response is not None and response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttled(response):
+    """A 429 or a Retry-After asks us to slow down rather than reporting an outage."""
+    return response is not None and (response.status_code == 429 or
+                                      retry_after_seconds(response) is not None)
+
+
+def backoff_seconds(response, attempt):
+    delay = retry_after_seconds(response)
+    if delay is None:
+        delay = random.uniform(0, 2 ** attempt)
+    return min(delay, MAX_BACKOFF_SECONDS)
+
+
+class OpenAlexClient:
+    """
+    Pooled HTTP client for the OpenAlex API. Every call goes through a
+    host-wide rate limiter, an adaptive in-flight limit and a circuit breaker,
+    and 429/5xx responses and request errors are retried with
+    Retry-After-aware backoff. A fail_fast client, for calls made while a web
+    request waits, doesn't retry or wait for the breaker.
+    """
+
+    def __init__(self, rate_limiter, fail_fast=False):
+        self.rate_limiter = rate_limiter
+        self.fail_fast = fail_fast
+        self.max_retries = 0 if fail_fast else openalex_max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4,
+                              pool_maxsize=openalex_max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.timeout = (openalex_connect_timeout, openalex_read_timeout)
+        self.concurrency = AdaptiveConcurrency(openalex_max_concurrency)
+        self.page_size = AimdLimit(200, 25, 200, increase=25)
+        self.breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD,
+                                      BREAKER_COOLDOWN_SECONDS)
+
+    def get(self, url, params=None):
+        """
+        Returns the first response that isn't retryable. After the last retry
+        the final response is returned, or the request error is raised.
+        While the circuit breaker is open, calls wait out its cooldown.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.breaker.wait(block=not self.fail_fast)
+            response, error = None, None
+            try:
+                with self.concurrency.slot():
+                    self.rate_limiter.acquire()
+                    start = time.time()
+                    try:
+                        response = self.session.get(url, params=params,
+                                                    timeout=self.timeout)
+                    except requests.exceptions.RequestException as e:
+                        error = e
+            finally:
+                if response is None and error is None:
+                    # whatever escaped must not leave the breaker on trial
+                    self.breaker.end_trial()
+            latency = time.time() - start
+
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                self.breaker.record_success()
+                self.concurrency.observe(latency)
+                return response
+
+            if is_throttled(response):
+                # the API is up, just busy; the backoff below handles it
+                self.breaker.end_trial()
+            else:
+                self.breaker.record_failure()
+            self.concurrency.on_failure()
+            if attempt == self.max_retries:
+                if response is not None:
+                    return response
+                raise error
+
+            delay = backoff_seconds(response, attempt)
+            status = response.status_code if response is not None else type(error).__name__
+            logger.info(f'OpenAlex request failed ({status}), retrying in {delay:.1f}s')
+            time.sleep(delay)
+
+    def get_json(self, url, params=None):
+        response = self.get(url, params=params)
+        if response.status_code != 200:
+            raise OpenAlexError(
+                f'OpenAlex API returned {response.status_code}',
+                response=response)
+        return response.json()
+
+
+# export workers' calls
+openalex_client = OpenAlexClient(openalex_rate_limiter)
+# calls made while answering a web request
+web_openalex_client = OpenAlexClient(web_rate_limiter, fail_fast=True)
@@ -1,16 +1,20 @@
 import csv
 import json
 import tempfile
-from io import StringIO
 from itertools import chain
 
-from formats.util import paginate, get_nested_value, get_first_page, \
-    unravel_index, truncate_format_row, build_dataframes, WORKS_DF_KEY, \
-    join_lists
+from app import csv_streaming
+from formats.csv_stream import export_csv_streaming
+from formats.util import paginate, get_nested_value, \
+    truncate_format_row, build_dataframes, WORKS_DF_KEY, join_lists
 
 
 def build_single_df(export):
-    dfs = build_dataframes(export)
+    return join_dataframes(build_dataframes(export))
+
+
+def join_dataframes(dfs):
+    """Joins each nested table onto the works table, one row per work."""
     for k in dfs.keys():
         if k == WORKS_DF_KEY:
             dfs[k] = dfs[k].map(join_lists)
@@ -31,15 +35,10 @@ def build_single_df(export):
 
 
 def export_csv(export):
+    if csv_streaming:
+        return export_csv_streaming(export)
     csv_filename = tempfile.mkstemp(suffix='.csv')[1]
     df = build_single_df(export)
     with open(csv_filename, 'w') as csv_file:
         df.to_csv(csv_file, index=False)
     return csv_filename
-
-
-def instant_export(export):
-    buffer = StringIO()
-    df = build_single_df(export)
-    df.to_csv(buffer, index=False)
-    return buffer.getvalue()
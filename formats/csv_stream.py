@@ -0,0 +1,461 @@
+import csv
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from functools import partial
+
+from formats.abstracts import split_abstracts, has_oa_flag
+from formats.s3 import S3MultipartWriter, streaming_s3_key
+from formats.util import paginate, object_columns_select, join_lists, \
+    truncate_string, open_partial_output, output_location, WORKS_DF_KEY
+
+# column kinds, mirroring the dtypes pandas infers for each page
+INT, FLOAT, BOOL, OBJECT = 'int', 'float', 'bool', 'object'
+
+_MISSING = object()
+
+
+def _flatten_into(flat, obj, prefix):
+    for key, value in obj.items():
+        new_key = f'{prefix}.{key}'
+        if isinstance(value, dict):
+            _flatten_into(flat, value, new_key)
+        else:
+            flat[new_key] = value
+
+
+def _flatten(obj):
+    """
+    Flatten nested dicts the way pd.json_normalize does for one record: the
+    top-level scalar keys come first, then each nested dict's keys in place.
+    """
+    flat = {key: value for key, value in obj.items()
+            if not isinstance(value, dict)}
+    for key, value in obj.items():
+        if isinstance(value, dict):
+            _flatten_into(flat, value, str(key))
+    return flat
+
+
+def _value_kind(value):
+    if isinstance(value, bool):
+        return BOOL
+    if isinstance(value, int):
+        return INT
+    if isinstance(value, float):
+        return FLOAT
+    return OBJECT
+
+
+def _page_kind(values):
+    """
+    The dtype pandas would infer for one page's column, where values uses
+    _MISSING for records that lack the key, and whether the column is all-NA
+    on that page. A column of only None is object, but None mixed with
+    missing keys (NaN) is float64.
+    """
+    kinds = set()
+    has_none = has_missing = False
+    for value in values:
+        if value is _MISSING:
+            has_missing = True
+        elif value is None:
+            has_none = True
+        else:
+            kinds.add(_value_kind(value))
+    if not kinds:
+        return (FLOAT if has_missing else OBJECT), True
+    has_na = has_none or has_missing
+    if OBJECT in kinds or (BOOL in kinds and len(kinds) > 1):
+        return OBJECT, False
+    if kinds == {BOOL}:
+        return (OBJECT if has_na else BOOL), False
+    if FLOAT in kinds or has_na:
+        return FLOAT, False
+    return INT, False
+
+
+def _combine_kinds(a, b):
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    if {a, b} == {INT, FLOAT}:
+        return FLOAT
+    return OBJECT
+
+
+class ColumnSchema:
+    """
+    Ordered set of columns for one table, with the dtype pandas would end up
+    with after concatenating every page. Like pd.concat, pages where a column
+    is all-NA don't count towards its dtype unless no page has a value.
+    """
+
+    def __init__(self):
+        # column: [kind of its pages with values, kind of its all-NA pages,
+        #          whether every value is a number, whether any page has NaN]
+        self.kinds = {}
+        self.missing = set()
+        self.pages = 0
+
+    def __iter__(self):
+        return iter(self.kinds)
+
+    def __contains__(self, column):
+        return column in self.kinds
+
+    def add_page(self, page_columns, records):
+        """Adds a page's columns and returns the kind of each on this page."""
+        page_kinds = {}
+        for column in page_columns:
+            kind, all_na = _page_kind(r.get(column, _MISSING) for r in records)
+            page_kinds[column] = kind
+            if column not in self.kinds:
+                self.kinds[column] = [None, None, True, False]
+                if self.pages:
+                    self.missing.add(column)
+            kinds = self.kinds[column]
+            if all_na:
+                kinds[1] = _combine_kinds(kinds[1], kind)
+            else:
+                kinds[0] = _combine_kinds(kinds[0], kind)
+                kinds[2] = kinds[2] and kind in (INT, FLOAT)
+            kinds[3] = kinds[3] or kind == FLOAT
+        self.missing.update(c for c in self.kinds if c not in page_columns)
+        self.pages += 1
+        return page_kinds
+
+    def to_state(self):
+        # lists rather than dicts, JSONB does not keep key order
+        return {'kinds': [[column] + kinds for column, kinds in
+                          self.kinds.items()],
+                'missing': sorted(self.missing),
+                'pages': self.pages}
+
+    @classmethod
+    def from_state(cls, state):
+        schema = cls()
+        schema.kinds = {}
+        for column, *kinds in state['kinds']:
+            if len(kinds) == 1:
+                # checkpoints written before all-NA pages were tracked
+                kind = kinds[0]
+                kinds = [kind, None, kind in (INT, FLOAT), kind == FLOAT]
+            schema.kinds[column] = kinds
+        schema.missing = set(state['missing'])
+        schema.pages = state['pages']
+        return schema
+
+    def kind(self, column):
+        kind, na_kind, _, _ = self.kinds[column]
+        if kind is None:
+            return na_kind
+        if column in self.missing:
+            # reindexing a page without this column introduces NaN, which the
+            # all-NA pages are then filled with
+            if kind == INT:
+                return FLOAT
+            if kind == BOOL:
+                return OBJECT
+            return kind
+        if na_kind is None or kind in (FLOAT, OBJECT):
+            return kind
+        # int and bool have no NaN, so their pages are concatenated with the
+        # all-NA ones as they are; numpy turns bools next to floats into 1.0
+        if kind == INT or na_kind == FLOAT:
+            return na_kind
+        return OBJECT
+
+    def mapped_kind(self, column):
+        """
+        The dtype after DataFrame.map, which re-infers object columns: numbers
+        and nulls become float64, as do nulls that include NaN.
+        """
+        kind = self.kind(column)
+        value_kind, _, numeric, has_nan = self.kinds[column]
+        if kind != OBJECT or not numeric:
+            return kind
+        if value_kind is not None or has_nan or column in self.missing:
+            return FLOAT
+        return OBJECT
+
+
+def _float_na_values(records, page_kinds):
+    """
+    Stores what a page's float64 columns hold: None became NaN (a missing
+    key here) and ints became floats.
+    """
+    columns = [c for c, kind in page_kinds.items() if kind == FLOAT]
+    for record in records:
+        for column in columns:
+            value = record.get(column, _MISSING)
+            if value is None:
+                del record[column]
+            elif isinstance(value, int) and not isinstance(value, bool):
+                record[column] = float(value)
+
+
+def _ordered_columns(records):
+    columns = {}
+    for record in records:
+        for column in record:
+            columns[column] = None
+    return list(columns)
+
+
+def _render_work_cell(value, kind):
+    if value is _MISSING or value is None:
+        return ''
+    if kind == FLOAT:
+        return str(float(value))
+    value = join_lists(value)
+    return str(value)
+
+
+def _render_nested_cell(value, kind):
+    if kind == FLOAT:
+        if value is _MISSING or value is None:
+            return 'nan'
+        return str(float(value))
+    if value is _MISSING:
+        return 'nan'
+    if isinstance(value, list):
+        return '|'.join(map(str, value))
+    return str(value)
+
+
+class StreamingCsvWriter:
+    """
+    Flattens pages of works into the same cells build_single_df produces,
+    spooling them to disk as they arrive so that only one page is held in
+    memory. The column schema is declared as pages are seen and the final CSV
+    is assembled in a single sequential pass once pagination finishes.
+    """
+
+    def __init__(self, args, spool_file):
+        self.args = args
+        self.spool_file = spool_file
+        self.works_schema = ColumnSchema()
+        self.nested_schemas = {}
+        self.raw_columns = ['id']
+        self.columns_map = {}
+
+    def to_state(self):
+        return {
+            'works': self.works_schema.to_state(),
+            'nested': [(table, schema.to_state()) for table, schema in
+                       self.nested_schemas.items()],
+            'raw_columns': self.raw_columns,
+            'columns_map': self.columns_map,
+        }
+
+    def restore(self, state):
+        self.works_schema = ColumnSchema.from_state(state['works'])
+        self.nested_schemas = {table: ColumnSchema.from_state(schema) for
+                               table, schema in state['nested']}
+        self.raw_columns = state['raw_columns']
+        self.columns_map = state['columns_map']
+
+    def add_page(self, page):
+        export_cols = self.args.get('columns')
+        truncate = self.args.get('truncate')
+
+        page, abstracts = split_abstracts(page)
+        records = [{k: v for k, v in _flatten(work).items() if
+                    'abstract_inverted' not in k} for work in page]
+        page_columns = _ordered_columns(records)
+
+        if has_oa_flag(page):
+            for record, abstract in zip(records, abstracts):
+                record['abstract'] = abstract
+            page_columns.append('abstract')
+
+        if export_cols:
+            self.raw_columns.extend(export_cols.split(','))
+            self.columns_map = object_columns_select(self.raw_columns)
+            keep = list(self.columns_map.keys()) + self.raw_columns
+            page_columns = [c for c in page_columns if c in keep]
+
+        nested_columns = [c for c in page_columns if
+                          self._is_nested(c, records)]
+        nested_rows = {}
+        for column in nested_columns:
+            rows = []
+            for record in records:
+                value = record.get(column)
+                items = value if isinstance(value, list) else []
+                rows.append([_flatten(item) for item in items])
+            nested_rows[column] = rows
+            self._add_nested_page(column, [i for r in rows for i in r])
+
+        page_columns = [c for c in page_columns if
+                        c not in nested_columns and
+                        c not in self.nested_schemas]
+        works = [{c: record[c] for c in page_columns if c in record}
+                 for record in records]
+        _float_na_values(works, self.works_schema.add_page(page_columns, works))
+
+        for i, work in enumerate(works):
+            nested = {column: rows[i] for column, rows in nested_rows.items()
+                      if rows[i]}
+            if truncate:
+                work = {k: truncate_string(v) for k, v in work.items()}
+                nested = {column: [{k: truncate_string(v) for k, v in
+                                    item.items()} for item in items]
+                          for column, items in nested.items()}
+            self.spool_file.write(json.dumps([work, nested]))
+            self.spool_file.write('\n')
+
+    @staticmethod
+    def _is_nested(column, records):
+        for record in records:
+            value = record.get(column)
+            if isinstance(value, list) and value:
+                return isinstance(value[0], dict)
+        return False
+
+    def _add_nested_page(self, column, items):
+        if not items:
+            return
+        schema = self.nested_schemas.setdefault(column, ColumnSchema())
+        item_columns = _ordered_columns(items)
+        if 'id' in item_columns:
+            item_columns.remove('id')
+            item_columns.insert(0, 'id')
+        if self.args.get('columns'):
+            keep = self.columns_map.get(column, [])
+            item_columns = [c for c in item_columns if c == keep]
+        _float_na_values(items, schema.add_page(item_columns, items))
+
+    def work_columns(self):
+        columns = [c for c in self.works_schema if
+                   c not in self.nested_schemas]
+        if self.args.get('columns'):
+            columns = [c for c in columns if c in self.raw_columns]
+        return columns
+
+    def write_csv(self, spool_file, csv_file):
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerows(self.csv_rows(spool_file))
+
+    def csv_rows(self, spool_file):
+        """The header and then each row of the single-file CSV."""
+        work_columns = [(c, self.works_schema.mapped_kind(c)) for c in
+                        self.work_columns()]
+        # only truncating maps the nested tables before they are joined
+        truncate = self.args.get('truncate')
+        nested_columns = [
+            (table, [(c, schema.mapped_kind(c) if truncate else schema.kind(c))
+                     for c in schema])
+            for table, schema in self.nested_schemas.items()
+        ]
+
+        header = [c for c, _ in work_columns]
+        for table, columns in nested_columns:
+            header.extend(f'{table}.{c}' for c, _ in columns)
+        yield header
+
+        for line in spool_file:
+            work, nested = json.loads(line)
+            row = [_render_work_cell(work.get(c, _MISSING), kind)
+                   for c, kind in work_columns]
+            for table, columns in nested_columns:
+                items = nested.get(table)
+                for c, kind in columns:
+                    if not items:
+                        row.append('')
+                        continue
+                    row.append('|'.join(
+                        _render_nested_cell(item.get(c, _MISSING), kind)
+                        for item in items))
+            yield row
+
+    def tables(self):
+        """
+        (name, write) for the works table and each nested table, where
+        write(spool_file, csv_file) writes that table on its own, with one row
+        per nested object, as the ZIP export does.
+        """
+        return [(WORKS_DF_KEY, self.write_works_csv)] + [
+            (table, partial(self.write_nested_csv, table))
+            for table in self.nested_schemas
+        ]
+
+    def write_works_csv(self, spool_file, csv_file):
+        work_columns = [(c, self.works_schema.mapped_kind(c)) for c in
+                        self.work_columns()]
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerow([c for c, _ in work_columns])
+        for line in spool_file:
+            work, _ = json.loads(line)
+            writer.writerow([_render_work_cell(work.get(c, _MISSING), kind)
+                             for c, kind in work_columns])
+
+    def write_nested_csv(self, table, spool_file, csv_file):
+        schema = self.nested_schemas[table]
+        columns = list(schema)
+        if columns and columns[0] == 'id':
+            header = ['id', 'work_id'] + columns[1:]
+        else:
+            header = ['work_id'] + columns
+
+        kinds = {c: schema.mapped_kind(c) for c in columns}
+
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerow(header)
+        for line in spool_file:
+            work, nested = json.loads(line)
+            for item in nested.get(table, []):
+                writer.writerow([
+                    str(work.get('id')) if c == 'work_id' else
+                    _render_work_cell(item.get(c, _MISSING), kinds[c])
+                    for c in header
+                ])
+
+
+def render_table(args, state, table, spool_path, csv_file):
+    """Writes one table from a spool, given the writer's to_state()."""
+    writer = StreamingCsvWriter(args, None)
+    writer.restore(state)
+    write_table = dict(writer.tables())[table]
+    with open(spool_path) as spool_file:
+        write_table(spool_file, csv_file)
+
+
+@contextmanager
+def spooled_export(export):
+    """
+    Pages the export into a spool file, resuming from its checkpoint when
+    possible, and yields (writer, spool_path) for rendering the output.
+    """
+    spool_file, resumed = open_partial_output(export, '.ndjson')
+    try:
+        with spool_file:
+            writer = StreamingCsvWriter(export.args, spool_file)
+            if resumed:
+                writer.restore(export.checkpoint['state'])
+            for page in paginate(export, spool_file.name, output=spool_file,
+                                 state=writer.to_state):
+                writer.add_page(page)
+        yield writer, spool_file.name
+    finally:
+        # a worker that dies outright never gets here, leaving the spool
+        # behind for the checkpoint
+        os.remove(spool_file.name)
+
+
+def export_csv_streaming(export):
+    with spooled_export(export) as (writer, spool_path):
+        return write_spooled_csv(writer, spool_path, streaming_s3_key(export))
+
+
+def write_spooled_csv(writer, spool_path, s3_key=None):
+    if s3_key:
+        csv_file = S3MultipartWriter(s3_key)
+    else:
+        csv_file = open(tempfile.mkstemp(suffix='.csv')[1], 'w')
+    with open(spool_path) as spool, csv_file:
+        writer.write_csv(spool, csv_file)
+    return output_location(csv_file)
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import re
+from urllib.parse import urlparse, parse_qs
+
+OPENALEX_ID_PREFIXES = ('https://openalex.org/', 'http://openalex.org/')
+# query args that don't change which works an export contains or how they render
+IGNORED_ARGS = {'api-key', 'api_key', 'mailto', 'cursor', 'page', 'per_page',
+                'per-page'}
+# args that change the rendered output, as opposed to the query
+OUTPUT_ARGS = ('is_async', 'truncate', 'select', 'columns')
+
+
+def _normalize_value(value):
+    value = re.sub(r'\s+', ' ', value.strip()).lower()
+    for prefix in OPENALEX_ID_PREFIXES:
+        if value.startswith(prefix):
+            return value[len(prefix):]
+    return value
+
+
+def _normalize_filter_value(value):
+    negated = value.startswith('!')
+    # "a|b" and "b|a" are the same OR
+    values = sorted({_normalize_value(v) for v in value.lstrip('!').split('|')})
+    return ('!' if negated else '') + '|'.join(values)
+
+
+def canonical_filter(filter_arg):
+    """
+    Sorts and normalizes the clauses of a filter argument, so that
+    "year:2020,type:article" and "type:Article, year:2020" compare equal.
+    """
+    clauses = set()
+    for clause in filter_arg.split(','):
+        if not clause.strip():
+            continue
+        key, _, value = clause.partition(':')
+        key = key.strip().lower().replace('-', '_')
+        clauses.add(f'{key}:{_normalize_filter_value(value)}')
+    return ','.join(sorted(clauses))
+
+
+def canonical_select(select_arg):
+    return ','.join(sorted({s.strip().lower() for s in select_arg.split(',')
+                            if s.strip()}))
+
+
+def canonical_query(query_url):
+    """The query args of an OpenAlex URL as a dict of normalized strings."""
+    parsed = urlparse(query_url)
+    canonical = {'path': parsed.path.rstrip('/').lower()}
+    for key, values in parse_qs(parsed.query).items():
+        key = key.lower().replace('-', '_')
+        if key in IGNORED_ARGS:
+            continue
+        if key == 'filter':
+            canonical[key] = canonical_filter(','.join(values))
+        elif key == 'select':
+            canonical[key] = canonical_select(','.join(values))
+        elif key in ('search', 'q'):
+            canonical[key] = _normalize_value(' '.join(values))
+        else:
+            # sort and group_bys order the output, so only whitespace is trimmed
+            canonical[key] = ','.join(v.strip() for v in values)
+    return canonical
+
+
+def query_fingerprint(query_url, args):
+    """
+    A hash of the canonical query and the args that shape the output. It
+    leaves out the format, so every format of the same query shares it.
+    """
+    output_args = {k: (args or {}).get(k) for k in OUTPUT_ARGS}
+    if output_args['select']:
+        output_args['select'] = canonical_select(output_args['select'])
+    key = json.dumps([canonical_query(query_url), output_args], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
@@ -1,28 +1,36 @@
 import csv
+import gzip
+import hashlib
+import json
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
 
-import requests
-from tenacity import retry, stop_after_attempt, wait_exponential
-
-from app import openalex_api_key
+from app import logger, group_by_cache_dir, group_by_cache_max_bytes, \
+    group_by_cache_ttl_minutes, group_by_fetch_workers, openalex_api_key
+from formats.client import openalex_client
+from formats.fingerprint import canonical_query
+from formats.page_cache import DiskPageCache
 
 GROUP_LIMIT = 15000  # max number of groups for a single group_by
 
+group_cache = DiskPageCache(group_by_cache_dir, group_by_cache_max_bytes,
+                            group_by_cache_ttl_minutes * 60, suffix='.json.gz')
+
 
 def export_group_bys_csv(export):
     group_bys, query = parse_query_url(export.query_url)
     csv_filename = tempfile.mkstemp(suffix=".csv")[1]
+    total_count, groups_by_dimension = fetch_all_groups(query, group_bys)
     csv_data = [
         [f"Your query: {export.query_url}"],
         [],
-        [f"Number of results: {get_total_count(query)}"],
+        [f"Number of results: {total_count}"],
         [],
     ]
 
     column_pointer = 0
-    for group_by in group_bys:
-        groups = fetch_group_data(query, group_by)
+    for group_by, groups in zip(group_bys, groups_by_dimension):
         csv_data, column_pointer = append_group_to_csv_data(
             csv_data, column_pointer, group_by, groups
         )
@@ -59,12 +67,62 @@ def parse_query_url(query_url):
     return group_bys, rebuilt_url
 
 
+def group_cache_key(query, group_by):
+    """
+    Key of a group_by's results under the canonical query, so reordered or
+    re-cased filters share entries. A group_by of None keys the total count.
+    """
+    key = json.dumps([canonical_query(query), group_by], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def get_cached(query, group_by):
+    try:
+        data = group_cache.get(group_cache_key(query, group_by))
+        return data and json.loads(gzip.decompress(data))
+    except Exception as e:
+        logger.warning(f'group-by cache read failed: {e}')
+        return None
+
+
+def put_cached(query, group_by, value):
+    try:
+        data = gzip.compress(json.dumps(value).encode('utf-8'), compresslevel=1)
+        group_cache.put(group_cache_key(query, group_by), data)
+    except Exception as e:
+        logger.warning(f'group-by cache write failed: {e}')
+
+
+def fetch_dimension(query, group_by):
+    return fetch_group_data(query, group_by) if group_by else get_total_count(query)
+
+
+def fetch_all_groups(query, group_bys):
+    """
+    Returns the total count and the groups of each group_by, in order. Cached
+    dimensions are read from disk, and the rest are fetched at once, at most
+    group_by_fetch_workers at a time, so the export takes about as long as
+    its slowest dimension.
+    """
+    results = {group_by: get_cached(query, group_by)
+               for group_by in [None, *group_bys]}
+    missing = [group_by for group_by, value in results.items() if value is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(group_by_fetch_workers, len(missing)),
+                                thread_name_prefix='group-by') as executor:
+            futures = {group_by: executor.submit(fetch_dimension, query, group_by)
+                       for group_by in missing}
+            for group_by, future in futures.items():
+                results[group_by] = future.result()
+                put_cached(query, group_by, results[group_by])
+    return results[None], [results[group_by] for group_by in group_bys]
+
+
 def get_total_count(query):
     # Add API key
     separator = '&' if '?' in query else '?'
     query = f"{query}{separator}api-key={openalex_api_key}"
-    r = requests.get(query)
-    return r.json()["meta"]["count"]
+    return openalex_client.get_json(query)["meta"]["count"]
 
 
 def fetch_group_data(query, group_by, per_page=50):
@@ -82,10 +140,8 @@ def fetch_group_data(query, group_by, per_page=50):
     return sorted(groups, key=lambda x: x["count"], reverse=True)
 
 
-@retry(wait=wait_exponential(multiplier=1, min=1, max=5), stop=stop_after_attempt(3))
 def get_request(url):
-    result = requests.get(url).json()
-    return result
+    return openalex_client.get_json(url)
 
 
 def append_group_to_csv_data(csv_data, column_pointer, group_by, groups):
@@ -0,0 +1,81 @@
+import csv
+import hashlib
+import json
+from io import StringIO
+
+from app import instant_cache_size, instant_cache_ttl_seconds, csv_streaming
+from formats.bib import bib_entries
+from formats.csv import join_dataframes
+from formats.csv_stream import StreamingCsvWriter
+from formats.fingerprint import query_fingerprint
+from formats.ris import ris_entries
+from formats.s3 import EXPORT_CONTENT_TYPES
+from formats.util import dataframes_from_pages
+from formats.wos_plaintext import HEADER as WOS_HEADER, wos_entries
+from util import TtlLruCache
+
+CONTENT_TYPES = {f: EXPORT_CONTENT_TYPES[f] for f in
+                 ('bib', 'csv', 'ris', 'wos-plaintext')}
+
+
+# rendered instant exports, per web worker process
+instant_cache = TtlLruCache(instant_cache_size, instant_cache_ttl_seconds)
+
+
+def instant_export_key(export):
+    return query_fingerprint(export.query_url, export.args), export.format
+
+
+def works_etag(key, works):
+    """An ETag for the rendering of works, known before rendering them."""
+    digest = hashlib.sha256(json.dumps(key).encode('utf-8'))
+    for work in works:
+        digest.update(json.dumps(work, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def csv_chunks(args, works):
+    if csv_streaming:
+        return streaming_csv_chunks(args, works)
+    df = join_dataframes(dataframes_from_pages(args, [works]))
+    return [df.to_csv(index=False)]
+
+
+def streaming_csv_chunks(args, works):
+    spool = StringIO()
+    writer = StreamingCsvWriter(args, spool)
+    writer.add_page(works)
+    spool.seek(0)
+    row_buffer = StringIO()
+    row_writer = csv.writer(row_buffer, lineterminator='\n')
+    for row in writer.csv_rows(spool):
+        row_writer.writerow(row)
+        yield row_buffer.getvalue()
+        row_buffer.seek(0)
+        row_buffer.truncate()
+
+
+def wos_chunks(works):
+    yield '\n'.join(WOS_HEADER) + '\n'
+    yield from wos_entries(works)
+
+
+def render_chunks(export_format, args, works):
+    if export_format == 'csv':
+        return csv_chunks(args, works)
+    elif export_format == 'ris':
+        return ris_entries(works)
+    elif export_format == 'wos-plaintext':
+        return wos_chunks(works)
+    elif export_format == 'bib':
+        return bib_entries(works)
+    raise ValueError(f'Invalid export format: {export_format}')
+
+
+def cache_as_rendered(key, etag, chunks):
+    """Yields chunks, caching the whole body once the last one is sent."""
+    sent = []
+    for chunk in chunks:
+        sent.append(chunk)
+        yield chunk
+    instant_cache.put(key, (etag, ''.join(sent)))
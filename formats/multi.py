@@ -0,0 +1,76 @@
+import os
+import tempfile
+from contextlib import ExitStack
+
+from formats.bib import write_bib_page
+from formats.csv_stream import StreamingCsvWriter, write_spooled_csv
+from formats.ris import write_ris_page
+from formats.s3 import S3MultipartWriter, streaming_s3_key
+from formats.util import paginate, output_location
+from formats.wos_plaintext import write_wos_header, write_wos_page
+from formats.zip import write_spooled_zip
+
+# formats rendered straight from each page, with their file suffix and header
+PAGE_FORMATS = {
+    'bib': ('.bib', write_bib_page, None),
+    'ris': ('.ris', write_ris_page, None),
+    'wos-plaintext': ('.txt', write_wos_page, write_wos_header),
+}
+# formats rendered from the flattened spool once every page has been seen
+SPOOLED_FORMATS = {'csv', 'zip'}
+MULTI_FORMATS = set(PAGE_FORMATS) | SPOOLED_FORMATS
+
+
+def open_output(export, export_format, suffix):
+    if s3_key := streaming_s3_key(export, export_format):
+        return S3MultipartWriter(s3_key, suffix=suffix)
+    return open(tempfile.mkstemp(suffix=suffix)[1], 'w')
+
+
+def export_multi(export):
+    """
+    Renders every format of a multi-format export from one pagination pass
+    and returns {format: location}. BibTeX, RIS and WOS are written as each
+    page arrives, while CSV and ZIP share a single flattened spool that is
+    rendered after the last page.
+
+    These exports aren't checkpointed; a re-run reads its pages back from
+    the page cache rather than the API.
+    """
+    formats = export.formats
+    locations = {}
+    with ExitStack() as stack:
+        page_writers = []
+        for export_format in formats:
+            if export_format in PAGE_FORMATS:
+                suffix, write_page, write_header = PAGE_FORMATS[export_format]
+                output = stack.enter_context(
+                    open_output(export, export_format, suffix))
+                if write_header:
+                    write_header(output)
+                page_writers.append((output, write_page))
+                locations[export_format] = output_location(output)
+
+        spool_writer = None
+        if SPOOLED_FORMATS.intersection(formats):
+            spool_file = stack.enter_context(
+                open(tempfile.mkstemp(suffix='.ndjson')[1], 'w'))
+            stack.callback(os.remove, spool_file.name)
+            spool_writer = StreamingCsvWriter(export.args, spool_file)
+            page_writers.append((spool_writer, StreamingCsvWriter.add_page))
+
+        for page in paginate(export, export.id):
+            for output, write_page in page_writers:
+                write_page(output, page)
+
+        if spool_writer:
+            spool_file.flush()
+            if 'csv' in formats:
+                locations['csv'] = write_spooled_csv(
+                    spool_writer, spool_file.name,
+                    streaming_s3_key(export, 'csv'))
+            if 'zip' in formats:
+                locations['zip'] = write_spooled_zip(
+                    export, spool_writer, spool_file.name)
+
+    return {export_format: locations[export_format] for export_format in formats}
@@ -0,0 +1,169 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from app import logger, page_cache_backend, page_cache_dir, \
+    page_cache_max_bytes, page_cache_ttl_minutes
+from formats.fingerprint import canonical_query
+from formats.s3 import EXPORT_BUCKET, get_s3_client
+
+S3_PREFIX = 'page-cache/'
+
+
+def page_key(query_url, filter_clause, cursor):
+    """
+    Content address of the page of a query at a cursor. Cursors are followed
+    from the cached pages themselves, so pages fetched with different
+    per_page values chain consistently.
+    """
+    key = json.dumps([canonical_query(query_url), filter_clause or '', cursor],
+                     sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def encode_page(page_json):
+    """Gzipped NDJSON: a line of meta, then one line per result."""
+    meta = {'count': page_json['meta']['count'],
+            'next_cursor': page_json['meta']['next_cursor']}
+    lines = [json.dumps(meta)] + [json.dumps(r) for r in page_json['results']]
+    return gzip.compress('\n'.join(lines).encode('utf-8'), compresslevel=1)
+
+
+def decode_page(data):
+    lines = gzip.decompress(data).decode('utf-8').split('\n')
+    return {'meta': json.loads(lines[0]),
+            'results': [json.loads(line) for line in lines[1:]]}
+
+
+class DiskPageCache:
+    """
+    Entries in a local directory shared by the host's processes. They expire
+    after ttl seconds, and the least recently used are evicted once the
+    directory grows past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes, ttl, suffix='.ndjson.gz'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.suffix = suffix
+        # bytes written since the directory was last measured
+        self._unmeasured_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+            # keep the entry's access time for LRU eviction
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+            return data
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        self._unmeasured_bytes += len(data)
+        if self._unmeasured_bytes >= self.max_bytes // 10:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_mtime, stat.st_size, entry.path))
+
+        now = time.time()
+        total = sum(size for _, _, size, _ in entries)
+        for atime, mtime, size, path in sorted(entries):
+            if now - mtime <= self.ttl and total <= self.max_bytes * 0.9:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._unmeasured_bytes = 0
+
+
+class S3PageCache:
+    """
+    Pages under a prefix of the export bucket, shared by every host. Entries
+    older than ttl are ignored; size is left to a lifecycle rule on the
+    prefix.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def get(self, key):
+        client = get_s3_client()
+        try:
+            response = client.get_object(Bucket=EXPORT_BUCKET, Key=S3_PREFIX + key)
+        except client.exceptions.NoSuchKey:
+            return None
+        if time.time() - response['LastModified'].timestamp() > self.ttl:
+            return None
+        return response['Body'].read()
+
+    def put(self, key, data):
+        get_s3_client().put_object(Bucket=EXPORT_BUCKET, Key=S3_PREFIX + key,
+                                   Body=data, ContentEncoding='gzip',
+                                   ContentType='application/x-ndjson')
+
+
+class PageCache:
+    """
+    Read-through cache of raw OpenAlex result pages, so rendering a recent
+    query again (in any format) makes no API calls. Failures are logged and
+    treated as misses.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, query_url, filter_clause, cursor):
+        if self.store is None:
+            return None
+        try:
+            data = self.store.get(page_key(query_url, filter_clause, cursor))
+            return data and decode_page(data)
+        except Exception as e:
+            logger.warning(f'page cache read failed: {e}')
+            return None
+
+    def put(self, query_url, filter_clause, cursor, page_json):
+        if self.store is None:
+            return
+        try:
+            self.store.put(page_key(query_url, filter_clause, cursor),
+                           encode_page(page_json))
+        except Exception as e:
+            logger.warning(f'page cache write failed: {e}')
+
+
+def make_store():
+    ttl = page_cache_ttl_minutes * 60
+    if page_cache_backend == 'disk':
+        return DiskPageCache(page_cache_dir, page_cache_max_bytes, ttl)
+    if page_cache_backend == 's3':
+        return S3PageCache(ttl)
+    return None
+
+
+page_cache = PageCache(make_store())
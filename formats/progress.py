@@ -0,0 +1,182 @@
+import datetime
+import threading
+import time
+
+from app import db, logger, progress_min_interval, progress_min_delta, \
+    progress_heartbeat
+from models import Export
+
+_NOT_SET = object()
+
+
+def write_export_progress(engine, export_id, progress, checkpoint=_NOT_SET):
+    """
+    Sets progress and progress_updated (and checkpoint, when given) on an
+    export with one UPDATE, without loading or merging the ORM object.
+    """
+    values = {'progress': progress,
+              'progress_updated': datetime.datetime.utcnow()}
+    if checkpoint is not _NOT_SET:
+        values['checkpoint'] = checkpoint
+    table = Export.__table__
+    with engine.begin() as connection:
+        connection.execute(
+            table.update().where(table.c.id == export_id).values(**values))
+
+
+def touch_export(engine, export_id):
+    table = Export.__table__
+    with engine.begin() as connection:
+        connection.execute(table.update().where(table.c.id == export_id).values(
+            progress_updated=datetime.datetime.utcnow()))
+
+
+class ExportHeartbeat:
+    """
+    Keeps an export's progress_updated fresh every interval seconds from a
+    background thread while it is rendered and uploaded after pagination, so
+    the stale export check doesn't hand a live export to another worker.
+    """
+
+    def __init__(self, export, interval=progress_heartbeat):
+        self.export_id = export.id
+        self.engine = db.engine
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f'heartbeat-{export.id}')
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                touch_export(self.engine, self.export_id)
+            except Exception as e:
+                logger.warning(f'failed to write heartbeat of {self.export_id}: {e}')
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ProgressReporter:
+    """
+    Coalesces an export's progress reports and writes them from a background
+    thread, so paging never waits on the database. A report is written once
+    progress has moved by min_delta and min_interval has passed since the last
+    write, or after heartbeat seconds regardless, which keeps progress_updated
+    fresh for the stale export check. A new checkpoint is written on the next
+    tick, or straight away by save(). close() writes whatever is still pending.
+    """
+
+    def __init__(self, export, min_interval=progress_min_interval,
+                 min_delta=progress_min_delta, heartbeat=progress_heartbeat):
+        self.export_id = export.id
+        # the background thread has no app context to look the engine up in
+        self.engine = db.engine
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self.heartbeat = heartbeat
+        self._progress = export.progress or 0
+        self._checkpoint = _NOT_SET
+        self._written_progress = self._progress
+        self._written_at = time.time()
+        self._closed = False
+        self._changed = threading.Condition()
+        # writes happen in the order their values were taken
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f'progress-{export.id}')
+        self._thread.start()
+
+    def report(self, progress, checkpoint=_NOT_SET):
+        with self._changed:
+            self._progress = progress
+            if checkpoint is not _NOT_SET:
+                self._checkpoint = checkpoint
+            self._changed.notify()
+
+    def _due(self, now):
+        since_write = now - self._written_at
+        if self._checkpoint is not _NOT_SET or since_write >= self.heartbeat:
+            return True
+        return since_write >= self.min_interval and \
+            abs(self._progress - self._written_progress) >= self.min_delta
+
+    def _take(self):
+        progress, checkpoint = self._progress, self._checkpoint
+        self._checkpoint = _NOT_SET
+        self._written_progress = progress
+        self._written_at = time.time()
+        return progress, checkpoint
+
+    def save(self, progress, checkpoint):
+        """
+        Writes progress and checkpoint in the calling thread, raising if that
+        fails, for a checkpoint that must be saved before the caller goes on.
+        """
+        with self._write_lock:
+            with self._changed:
+                self._progress = progress
+                self._checkpoint = checkpoint
+                progress, checkpoint = self._take()
+            write_export_progress(self.engine, self.export_id, progress,
+                                  checkpoint)
+
+    def _write_due(self):
+        """Writes the pending report if it is still due. False if that fails."""
+        with self._write_lock:
+            with self._changed:
+                # save() may have written it in the meantime
+                if not self._due(time.time()):
+                    return True
+                progress, checkpoint = self._take()
+            try:
+                write_export_progress(self.engine, self.export_id, progress,
+                                      checkpoint)
+                return True
+            except Exception as e:
+                logger.warning(f'failed to write progress of {self.export_id}: {e}')
+                with self._changed:
+                    self._written_progress = -1
+                    if checkpoint is not _NOT_SET and self._checkpoint is _NOT_SET:
+                        self._checkpoint = checkpoint
+                return False
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._closed and not self._due(time.time()):
+                    self._changed.wait(self.min_interval)
+                if self._closed:
+                    return
+            if not self._write_due():
+                # the next tick or close() will try again with newer values
+                with self._changed:
+                    self._changed.wait(self.min_interval)
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._changed.notify()
+        self._thread.join()
+        pending = self._checkpoint is not _NOT_SET or \
+            self._progress != self._written_progress
+        if pending:
+            try:
+                write_export_progress(self.engine, self.export_id,
+                                      *self._take())
+            except Exception as e:
+                logger.warning(f'failed to write progress of {self.export_id}: {e}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
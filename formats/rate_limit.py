@@ -0,0 +1,66 @@
+import fcntl
+import os
+import struct
+import time
+
+from app import openalex_rate_limit, openalex_rate_burst, \
+    openalex_rate_limit_file, openalex_web_rate_limit, \
+    openalex_web_rate_burst, openalex_web_rate_limit_file
+
+_STATE = struct.Struct('dd')  # tokens, last refill time
+
+
+class FileTokenBucket:
+    """
+    Token bucket shared by every process on the host through a small state
+    file guarded by an exclusive flock. Each acquire() takes one token,
+    sleeping until one is available.
+    """
+
+    def __init__(self, path, rate, burst=1):
+        self.path = path
+        self.rate = rate
+        self.burst = max(burst, 1)
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _try_acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            data = os.pread(fd, _STATE.size, 0)
+            if len(data) == _STATE.size:
+                tokens, updated = _STATE.unpack(data)
+                tokens = min(self.burst,
+                             tokens + max(now - updated, 0) * self.rate)
+            else:
+                tokens = self.burst
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+
+            os.pwrite(fd, _STATE.pack(tokens, now), 0)
+            return wait
+        finally:
+            os.close(fd)  # also releases the lock
+
+
+# export workers
+openalex_rate_limiter = FileTokenBucket(openalex_rate_limit_file,
+                                        openalex_rate_limit,
+                                        openalex_rate_burst)
+# web workers
+web_rate_limiter = FileTokenBucket(openalex_web_rate_limit_file,
+                                   openalex_web_rate_limit,
+                                   openalex_web_rate_burst)
@@ -1,9 +1,9 @@
-import tempfile
-from io import StringIO
 from nameparser import HumanName
 
-from formats.util import paginate, get_nested_value, get_first_page, \
-    unravel_index
+from formats.abstracts import reconstruct_abstract
+from formats.s3 import streaming_s3_key
+from formats.util import paginate, get_nested_value, open_partial_output, \
+    output_location
 
 RIS_CONTENT_TYPE = 'text/x-ris'
 
@@ -82,27 +82,29 @@ def build_ris_entry(work):
         ris_entry.append(f"EP  - {work.get('biblio', {}).get('last_page', '')}")
 
     if work.get('abstract_inverted_index') and (work.get('open_access') or {}).get('is_oa'):
-        ris_entry.append(f"AB  - {unravel_index(work['abstract_inverted_index'])}")
+        abstract = reconstruct_abstract(work['abstract_inverted_index'],
+                                        fill_gaps=False).replace("\n", "")
+        ris_entry.append(f"AB  - {abstract}")
 
     ris_entry.append('ER  -\n')
 
     return "\n".join(ris_entry)
 
 
-def export_ris(export):
-    fname = tempfile.mkstemp(suffix='.ris')[1]
-    with open(fname, 'w') as f:
-        for page in paginate(export, fname):
-            for work in page:
-                ris_entry = build_ris_entry(work)
-                f.write(ris_entry)
-    return fname
-
-
-def instant_export(export):
-    first_page = get_first_page(export)
-    buffer = StringIO()
-    for work in first_page['results']:
+def write_ris_page(f, page):
+    for work in page:
         ris_entry = build_ris_entry(work)
-        buffer.write(ris_entry)
-    return buffer.getvalue()
+        f.write(ris_entry)
+
+
+def ris_entries(page):
+    for work in page:
+        yield build_ris_entry(work)
+
+
+def export_ris(export):
+    f, _ = open_partial_output(export, '.ris', streaming_s3_key(export))
+    with f:
+        for page in paginate(export, f.name, output=f):
+            write_ris_page(f, page)
+    return output_location(f)
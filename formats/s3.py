@@ -0,0 +1,179 @@
+import os
+import tempfile
+
+import boto3
+
+from app import logger, supported_formats, s3_endpoint_url, \
+    s3_part_size, export_s3_streaming, presigned_url_expires_seconds
+from util import TtlLruCache
+
+EXPORT_BUCKET = 'openalex-query-exports'
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'group-bys-csv': 'text/csv',
+    'wos-plaintext': 'text/x-wos',
+    'ris': 'text/x-ris',
+    'zip': 'application/zip',
+    'bib': 'application/x-bibtex; charset=utf-8',
+}
+
+# handed out while they have at least a minute of validity left
+_presigned_urls = TtlLruCache(10_000, max(presigned_url_expires_seconds - 60, 0))
+
+_s3_client = None
+
+
+def get_s3_client():
+    # boto3 clients are thread safe, so one per process is enough
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3', endpoint_url=s3_endpoint_url)
+    return _s3_client
+
+
+def presigned_download_url(key, filename, content_type):
+    cache_key = (key, filename, content_type)
+    if url := _presigned_urls.get(cache_key):
+        return url
+    url = get_s3_client().generate_presigned_url(
+        'get_object',
+        Params={
+            'Bucket': EXPORT_BUCKET,
+            'Key': key,
+            'ResponseContentDisposition': f'attachment; filename={filename}',
+            'ResponseContentType': content_type,
+        },
+        ExpiresIn=presigned_url_expires_seconds
+    )
+    _presigned_urls.put(cache_key, url)
+    return url
+
+
+def export_s3_key(export, export_format=None):
+    """The key of the export's output, or of one of a multi-format export's."""
+    return f'{export.id}.{supported_formats[export_format or export.format]}'
+
+
+def streaming_s3_key(export, export_format=None):
+    """The key to stream an async export's output to, or None to use a file."""
+    if export_s3_streaming and export.args.get('is_async'):
+        return export_s3_key(export, export_format)
+    return None
+
+
+class S3MultipartWriter:
+    """
+    Text file-like object that sends what is written to it to an S3 multipart
+    upload, so the object is complete as soon as the last page is rendered.
+    Writes are buffered in a local tail file and uploaded as a part once it
+    reaches s3_part_size. With upload_on_flush, parts are only uploaded from
+    upload_state(), so the upload id, parts and tail offset saved in a
+    checkpoint always describe the same output.
+    """
+
+    def __init__(self, key, tail_path=None, upload_id=None, parts=None,
+                 upload_on_flush=False, suffix='.part'):
+        self.client = get_s3_client()
+        self.key = key
+        self.upload_on_flush = upload_on_flush
+        if upload_id is None:
+            upload_id = self.client.create_multipart_upload(
+                Bucket=EXPORT_BUCKET, Key=key)['UploadId']
+        self.upload_id = upload_id
+        self.parts = list(parts or [])
+        self.tail = open(tail_path or tempfile.mkstemp(suffix=suffix)[1], 'ab')
+        # the tail went up as the last part but is kept until drop_tail()
+        self.tail_uploaded = False
+
+    @property
+    def name(self):
+        return self.tail.name
+
+    @property
+    def url(self):
+        return f's3://{EXPORT_BUCKET}/{self.key}'
+
+    def write(self, s):
+        self.tail.write(s.encode('utf-8'))
+        if not self.upload_on_flush and self.tail.tell() >= s3_part_size:
+            self._upload_tail()
+
+    def flush(self):
+        self.tail.flush()
+
+    def fileno(self):
+        return self.tail.fileno()
+
+    def upload_state(self):
+        """
+        A snapshot of the upload for a checkpoint: the parts so far and the
+        size of the tail that follows them. A tail of at least s3_part_size
+        is uploaded as the next part first, but it stays on disk, matching the
+        previous checkpoint, until drop_tail() is called once this one is
+        saved.
+        """
+        self.tail.flush()
+        if not self.tail_uploaded and self.tail.tell() >= s3_part_size:
+            self._upload_part()
+            self.tail_uploaded = True
+        return {'key': self.key, 'upload_id': self.upload_id,
+                'parts': list(self.parts),
+                'offset': 0 if self.tail_uploaded else self.tail.tell()}
+
+    def drop_tail(self):
+        """Empties the tail after it was uploaded as a part."""
+        self.tail.seek(0)
+        self.tail.truncate()
+        self.tail_uploaded = False
+
+    def _upload_part(self):
+        self.tail.flush()
+        with open(self.tail.name, 'rb') as f:
+            body = f.read()
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=EXPORT_BUCKET, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=body)
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+    def _upload_tail(self):
+        self._upload_part()
+        self.drop_tail()
+
+    def close(self):
+        if self.tail_uploaded:
+            self.drop_tail()
+        # the last part may be smaller than the minimum part size
+        if self.tail.tell() or not self.parts:
+            self._upload_tail()
+        self.client.complete_multipart_upload(
+            Bucket=EXPORT_BUCKET, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts})
+        self._remove_tail()
+        logger.info(f'completed upload of {self.url} in {len(self.parts)} parts')
+
+    def abort(self):
+        abort_upload(self.key, self.upload_id)
+        self._remove_tail()
+
+    def _remove_tail(self):
+        self.tail.close()
+        os.remove(self.tail.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def abort_upload(key, upload_id):
+    try:
+        get_s3_client().abort_multipart_upload(
+            Bucket=EXPORT_BUCKET, Key=key, UploadId=upload_id)
+    except Exception as e:
+        logger.warning(f'failed to abort upload {upload_id} of {key}: {e}')
@@ -0,0 +1,106 @@
+from math import ceil
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+
+from app import logger, openalex_api_key, export_max_shards, \
+    export_shard_min_results
+from formats.group_bys import get_request
+
+SHARD_FIELD = 'publication_year'
+
+# args that make the order or membership of results depend on the whole query
+UNSHARDABLE_ARGS = ['sort', 'sample', 'seed']
+
+
+def planning_url(query_url, **extra_args):
+    parsed_query_url = urlparse(query_url)
+    query_args = parse_qs(parsed_query_url.query)
+    for arg in ['select', 'cursor', 'page', 'per_page', 'per-page'] + UNSHARDABLE_ARGS:
+        query_args.pop(arg, None)
+    query_args.update(extra_args)
+    query_args['api-key'] = openalex_api_key
+    return urlunparse(parsed_query_url._replace(
+        query=urlencode(query_args, doseq=True)
+    ))
+
+
+def get_year_counts(query_url):
+    year_counts = {}
+    cursor = '*'
+    while cursor is not None:
+        result = get_request(planning_url(query_url, group_by=SHARD_FIELD,
+                                          per_page=200, cursor=cursor))
+        cursor = result['meta'].get('next_cursor')
+        for group in result['group_by']:
+            year_counts[int(group['key'])] = group['count']
+    return dict(sorted(year_counts.items()))
+
+
+def year_ranges(year_counts, shard_count):
+    """Greedily packs consecutive years into shards of about equal size."""
+    target = sum(year_counts.values()) / shard_count
+    ranges = []
+    start, size = None, 0
+    for year, count in year_counts.items():
+        if start is None:
+            start = year
+        size += count
+        if size >= target and len(ranges) < shard_count - 1:
+            ranges.append((start, year))
+            start, size = None, 0
+    if start is not None:
+        ranges.append((start, max(year_counts)))
+    return ranges
+
+
+def range_filters(ranges):
+    # open-ended first and last shards so every year is covered exactly once
+    filters = []
+    for i, (start, end) in enumerate(ranges):
+        if len(ranges) == 1:
+            continue
+        if i == 0:
+            filters.append(f'{SHARD_FIELD}:<{end + 1}')
+        elif i == len(ranges) - 1:
+            filters.append(f'{SHARD_FIELD}:>{start - 1}')
+        elif start == end:
+            filters.append(f'{SHARD_FIELD}:{start}')
+        else:
+            filters.append(f'{SHARD_FIELD}:{start}-{end}')
+    return filters
+
+
+def plan_shards(export, max_results):
+    """
+    Splits an export into disjoint publication_year filters sized from
+    meta.count. Returns (total_count, filters), with no filters when the
+    export should be paged as a single cursor chain.
+    """
+    if export_max_shards < 2:
+        return None, []
+
+    query_args = parse_qs(urlparse(export.query_url).query)
+    if any(arg in query_args for arg in UNSHARDABLE_ARGS):
+        return None, []
+
+    try:
+        total_count = get_request(
+            planning_url(export.query_url, per_page=1, select='id')
+        )['meta']['count']
+        if total_count < export_shard_min_results or total_count > max_results:
+            return total_count, []
+
+        year_counts = get_year_counts(export.query_url)
+    except Exception as e:
+        logger.warning(f'not sharding {export.id}: {e}')
+        return None, []
+
+    if sum(year_counts.values()) != total_count:
+        # works without a publication year would fall outside every shard
+        return total_count, []
+
+    shard_count = min(export_max_shards,
+                      ceil(total_count / export_shard_min_results))
+    filters = range_filters(year_ranges(year_counts, shard_count))
+    if filters:
+        logger.info(f'paging {export.id} as {len(filters)} shards: {filters}')
+    return total_count, filters
@@ -1,14 +1,23 @@
-import datetime
 import itertools
-import time
-from math import ceil
+import os
+import queue
+import tempfile
+import threading
+from collections import namedtuple
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
 
 import pandas as pd
-import requests
 from requests import JSONDecodeError
 
-from app import db, logger, openalex_api_key
+from app import db, logger, openalex_api_key, dataframe_memory_budget, \
+    paginate_prefetch_pages, openalex_max_retries, export_checkpoint_pages
+from formats.abstracts import split_abstracts, has_oa_flag
+from formats.accumulator import DataFrameAccumulator
+from formats.client import openalex_client, web_openalex_client, OpenAlexError
+from formats.page_cache import page_cache
+from formats.progress import ProgressReporter, write_export_progress
+from formats.s3 import S3MultipartWriter, abort_upload
+from formats.sharding import plan_shards
 
 TRUNCATE_MAX_CHARS = 30_000
 
@@ -16,15 +25,15 @@ WORKS_DF_KEY = 'works'
 
 
 def update_export_progress(export, progress):
-    export.progress = progress
-    export.progress_updated = datetime.datetime.utcnow()
-    db.session.merge(export)
-    db.session.commit()
+    write_export_progress(db.engine, export.id, progress)
 
 
-def construct_query_url(cursor, export, per_page):
+def construct_query_url(cursor, export, per_page, filter_clause=None):
     parsed_query_url = urlparse(export.query_url)
     query_args = parse_qs(parsed_query_url.query)
+    if filter_clause:
+        query_args['filter'] = [
+            ','.join(query_args.get('filter', []) + [filter_clause])]
     query_args['cursor'] = cursor
     query_args['per_page'] = per_page
     query_args['api-key'] = openalex_api_key
@@ -36,41 +45,225 @@ def construct_query_url(cursor, export, per_page):
     return query_url
 
 
-def paginate(export, fname=None, max_results=200 * 250):
-    page = 1
-    cursor = '*'
-    per_page = 200
-    results_count = 0
+Page = namedtuple('Page', ['results', 'count', 'next_cursor', 'filter_clause'])
 
-    s = requests.session()
+
+def fetch_pages(export, max_results=200 * 250, filter_clause=None, cursor='*',
+                results_count=0):
+    decode_failures = 0
 
     while results_count <= max_results and cursor is not None:
-        query_url = construct_query_url(cursor, export, per_page)
-        try:
-            r = s.get(query_url)
-            time.sleep(0.3)
-            j = r.json()
-        except JSONDecodeError:
-            per_page = ceil(per_page / 2)
-            continue
-        per_page = min(200, per_page * 2)
-        total_count = j['meta']['count']
+        if not (j := page_cache.get(export.query_url, filter_clause, cursor)):
+            per_page = openalex_client.page_size.value
+            query_url = construct_query_url(cursor, export, per_page,
+                                            filter_clause)
+            r = openalex_client.get(query_url)
+            if r.status_code != 200:
+                raise OpenAlexError(f'OpenAlex API returned {r.status_code}',
+                                    response=r)
+            try:
+                j = r.json()
+            except JSONDecodeError:
+                # large pages sometimes come back truncated, retry with fewer
+                openalex_client.page_size.on_failure()
+                decode_failures += 1
+                if decode_failures > openalex_max_retries:
+                    raise
+                continue
+            decode_failures = 0
+            openalex_client.page_size.observe(r.elapsed.total_seconds())
+            page_cache.put(export.query_url, filter_clause, cursor, j)
         cursor = j['meta']['next_cursor']
         results = j['results']
         results_count += len(results)
 
-        yield results
+        yield Page(results, j['meta']['count'], cursor, filter_clause)
+
+
+_PREFETCH_DONE = object()
+
+
+def prefetch(iterator, depth):
+    """
+    Runs iterator in a background thread, at most depth items ahead of the
+    consumer. Exceptions raised by the iterator are re-raised to the consumer,
+    and closing the returned generator stops the background thread.
+    """
+    return prefetch_all([iterator], depth)
+
+
+def prefetch_all(iterators, depth):
+    """
+    Like prefetch, but runs each iterator in its own thread and yields their
+    items in whatever order they arrive.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(iterator):
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+            put((_PREFETCH_DONE, None))
+        except Exception as e:
+            put((None, e))
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    for iterator in iterators:
+        threading.Thread(target=run, args=(iterator,), daemon=True).start()
+    try:
+        running = len(iterators)
+        while running:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _PREFETCH_DONE:
+                running -= 1
+                continue
+            yield item
+    finally:
+        stop.set()
+
+
+def open_partial_output(export, suffix, s3_key=None):
+    """
+    Opens the export's output for appending: a temp file, or a multipart
+    upload to s3_key when given. If the export has a checkpoint whose partial
+    output is still on this disk, that file is cut back to the checkpointed
+    offset and reopened (along with its upload); otherwise the checkpoint is
+    dropped and the output starts empty. Returns (output, resumed).
+    """
+    checkpoint = export.checkpoint or {}
+    path = checkpoint.get('path')
+    upload = checkpoint.get('upload')
+    if path and path.endswith(suffix) and os.path.exists(path) and \
+            os.path.getsize(path) >= checkpoint['offset'] and \
+            (upload or {}).get('key') == s3_key:
+        os.truncate(path, checkpoint['offset'])
+        logger.info(f'resuming {export.id} from {checkpoint["results_count"]} results in {path}')
+        if s3_key:
+            return S3MultipartWriter(s3_key, path, upload['upload_id'],
+                                     upload['parts'], upload_on_flush=True), True
+        return open(path, 'a'), True
+
+    if upload:
+        abort_upload(upload['key'], upload['upload_id'])
+    export.checkpoint = None
+    if s3_key:
+        return S3MultipartWriter(s3_key, upload_on_flush=True,
+                                 suffix=suffix), False
+    return open(tempfile.mkstemp(suffix=suffix)[1], 'w'), False
+
+
+def output_location(output):
+    """What a format function returns for output: its s3:// url or file name."""
+    return getattr(output, 'url', output.name)
+
+
+def build_checkpoint(cursors, results_count, total_count, output, state):
+    output.flush()
+    upload = output.upload_state() if hasattr(output, 'upload_state') else None
+    return {
+        'cursors': dict(cursors),
+        'results_count': results_count,
+        'total_count': total_count,
+        'path': output.name,
+        # taken with the parts, so the two always describe the same output
+        'offset': upload['offset'] if upload else os.fstat(output.fileno()).st_size,
+        'upload': upload,
+        'state': state() if state else None,
+    }
 
-        if not export.args.get('is_async'):
-            update_export_progress(export, 1)
-            break
 
-        # Update progress after every page for best user experience
-        percent_complete = results_count / total_count if total_count > 0 else 1
-        update_export_progress(export, percent_complete)
-        if fname:
-            logger.info(f'wrote {results_count}/{total_count} to {fname}')
-        page += 1
+def paginate(export, fname=None, max_results=200 * 250, output=None,
+             state=None):
+    """
+    Yields each page of results for the export. When output (the file the
+    caller appends each page to) is given, a checkpoint of the cursors,
+    result count, output offset and state() is saved every
+    export_checkpoint_pages pages, and an existing checkpoint is resumed.
+    """
+    checkpoint = (export.checkpoint or {}) if output else {}
+    results_count = checkpoint.get('results_count', 0)
+    total_count = export_total_count = checkpoint.get('total_count')
+    # next cursor for each shard's filter clause, '' when the export is unsharded
+    cursors = checkpoint.get('cursors')
+    if cursors is None:
+        cursors = {'': '*'}
+        if export.args.get('is_async'):
+            export_total_count, shard_filters = plan_shards(export, max_results)
+            if shard_filters:
+                cursors = {f: '*' for f in shard_filters}
+    sharded = '' not in cursors
+
+    page_iterators = [
+        fetch_pages(export, max_results, f or None, cursor,
+                    0 if sharded else results_count)
+        for f, cursor in cursors.items() if cursor is not None
+    ]
+    if not page_iterators:
+        # every cursor was exhausted before the worker stopped
+        return
+    if len(page_iterators) > 1:
+        pages = prefetch_all(page_iterators,
+                             max(paginate_prefetch_pages, len(page_iterators)))
+    elif export.args.get('is_async') and paginate_prefetch_pages > 0:
+        pages = prefetch(page_iterators[0], paginate_prefetch_pages)
+    else:
+        pages = page_iterators[0]
+
+    reporter = ProgressReporter(export) if export.args.get('is_async') else None
+    if reporter and output and not checkpoint:
+        # forget any checkpoint open_partial_output dropped
+        reporter.report(export.progress or 0, checkpoint=None)
+    pages_since_checkpoint = 0
+    try:
+        for page in pages:
+            cursors[page.filter_clause or ''] = page.next_cursor
+            # shards report their own counts, progress is against the export's
+            total_count = export_total_count if sharded else page.count
+            results_count += len(page.results)
+
+            yield page.results
+
+            if not export.args.get('is_async'):
+                update_export_progress(export, 1)
+                break
+
+            percent_complete = results_count / total_count if total_count > 0 else 1
+            pages_since_checkpoint += 1
+            if output and pages_since_checkpoint >= export_checkpoint_pages:
+                new_checkpoint = build_checkpoint(cursors, results_count,
+                                                  total_count, output, state)
+                if getattr(output, 'tail_uploaded', False):
+                    # the saved checkpoint must list the new part before the
+                    # tail it was read from is gone, or a resume would apply
+                    # the old parts to the bytes after it
+                    reporter.save(percent_complete, new_checkpoint)
+                    output.drop_tail()
+                else:
+                    reporter.report(percent_complete, checkpoint=new_checkpoint)
+                pages_since_checkpoint = 0
+            else:
+                reporter.report(percent_complete)
+            if fname:
+                logger.info(f'wrote {results_count}/{total_count} to {fname}')
+    finally:
+        pages.close()
+        if reporter:
+            reporter.close()
 
 
 def get_nested_value(work, *keys):
@@ -90,17 +283,6 @@ def parse_bool(s):
         raise ValueError("Invalid boolean value: {}".format(s))
 
 
-def unravel_index(inverted_index):
-    unraveled = {}
-    for key, values in inverted_index.items():
-        for value in values:
-            unraveled[value] = key
-
-    sorted_unraveled = dict(sorted(unraveled.items()))
-    result = " ".join(sorted_unraveled.values()).replace("\n", "")
-    return result
-
-
 def get_first_page(export):
     params = {
         'page': '1',
@@ -108,9 +290,8 @@ def get_first_page(export):
         'api-key': openalex_api_key,
 
     }
-    response = requests.get(export.query_url, params=params)
-    time.sleep(0.3)
-    return response.json()
+    # only the web workers ask for a first page
+    return web_openalex_client.get_json(export.query_url, params=params)
 
 
 def truncate_format_str(cell_str):
@@ -164,36 +345,24 @@ def join_lists(cell):
     return cell
 
 
-def reconstruct_abstract(row, inverted_columns):
-    word_positions = {}
-    for col in inverted_columns:
-        word = col.split('.', maxsplit=1)[-1]
-        indexes = row[col]
-        if not isinstance(indexes, list):
-            continue
-        for index in indexes:
-            word_positions[index] = word
-    # Create a list of words in correct order
-    max_index = max(word_positions.keys(), default=-1)
-    abstract = [word_positions.get(i, '') for i in range(max_index + 1)]
-    return ' '.join(abstract)
+def build_dataframes(export):
+    return dataframes_from_pages(export.args, paginate(export))
 
 
-def build_dataframes(export):
-    dfs = dict()
+def dataframes_from_pages(args, pages):
+    works = DataFrameAccumulator(dataframe_memory_budget)
+    nested = dict()
     raw_columns = ['id']
     columns_map = {}
-    for page in paginate(export):
+    for page in pages:
+        page, abstracts = split_abstracts(page)
         df = pd.json_normalize(page)
         drop_columns = [col for col in df.columns if
                         'abstract_inverted' in col]
-        if 'open_access.is_oa' in df.columns:
-            df['abstract'] = df.apply(reconstruct_abstract,
-                                      inverted_columns=drop_columns,
-                                      axis=1)
-            df.loc[~df['open_access.is_oa'], 'abstract'] = ''
         df.drop(columns=drop_columns, inplace=True)
-        export_cols = export.args.get('columns')
+        if has_oa_flag(page):
+            df['abstract'] = abstracts
+        export_cols = args.get('columns')
         if export_cols:
             raw_columns.extend(export_cols.split(','))
             columns_map = object_columns_select(raw_columns)
@@ -201,11 +370,6 @@ def build_dataframes(export):
                             col not in list(
                                 columns_map.keys()) + raw_columns]
             df.drop(columns=drop_columns, inplace=True)
-        if WORKS_DF_KEY not in dfs:
-            dfs[WORKS_DF_KEY] = df
-        else:
-            dfs[WORKS_DF_KEY] = pd.concat([dfs[WORKS_DF_KEY], df],
-                                          axis=0).reset_index(drop=True)
         for col in df.columns:
             filtered_series = df[col].dropna().apply(
                 lambda x: x if isinstance(x, list) else [])
@@ -217,26 +381,25 @@ def build_dataframes(export):
                 sub_df = pd.json_normalize(
                     list(itertools.chain(*col_list_form)))
                 sub_df = set_column_order(sub_df)
-                if export.args.get('columns'):
+                if args.get('columns'):
                     drop_columns = [column for column in sub_df.columns if
                                     column not in [columns_map.get(col, [])] + [
                                         'work_id']]
                     sub_df.drop(columns=drop_columns, inplace=True)
-                dfs[WORKS_DF_KEY].drop(columns=[col], inplace=True)
-                if col in dfs:
-                    dfs[col] = pd.concat([dfs[col], sub_df],
-                                         axis=0).reset_index(drop=True)
-                else:
-                    dfs[col] = sub_df
-        drop_columns = [key for key in dfs.keys() if
-                        key in dfs[WORKS_DF_KEY].columns]
-        if drop_columns:
-            dfs[WORKS_DF_KEY].drop(columns=drop_columns, inplace=True)
-    if export.args.get('columns'):
+                if col not in nested:
+                    nested[col] = DataFrameAccumulator(dataframe_memory_budget)
+                nested[col].append(sub_df)
+        drop_columns = [key for key in nested.keys() if key in df.columns]
+        works.append(df.drop(columns=drop_columns))
+    # nested columns found on a later page are dropped from earlier chunks here
+    dfs = {WORKS_DF_KEY: works.materialize(drop_columns=list(nested.keys()))}
+    for col, accumulator in nested.items():
+        dfs[col] = accumulator.materialize()
+    if args.get('columns'):
         drop_columns = [col for col in dfs[WORKS_DF_KEY].columns if
                         col not in raw_columns]
         dfs[WORKS_DF_KEY].drop(columns=drop_columns, inplace=True)
-    if export.args.get('truncate'):
+    if args.get('truncate'):
         for k in dfs.keys():
             dfs[k] = dfs[k].applymap(truncate_string)
     return dfs
@@ -0,0 +1,49 @@
+import hashlib
+import json
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+
+from app import openalex_api_key, validation_cache_dir, \
+    validation_cache_ttl_seconds
+from formats.client import web_openalex_client, OpenAlexError
+from formats.fingerprint import canonical_query
+from formats.page_cache import DiskPageCache
+
+# shared by the host's gunicorn workers
+validation_cache = DiskPageCache(validation_cache_dir, 64 * 1024 * 1024,
+                                 validation_cache_ttl_seconds, suffix='.json')
+
+
+def validation_url(query_url):
+    """
+    The query asking for a single result, so validating it only downloads
+    the meta block. A select given by the user is kept so it is validated too.
+    """
+    parsed = urlparse(query_url)
+    query_args = parse_qs(parsed.query)
+    query_args['per_page'] = ['1']
+    query_args.setdefault('select', ['id'])
+    query_args['api-key'] = [openalex_api_key]
+    return urlunparse(parsed._replace(query=urlencode(query_args, doseq=True)))
+
+
+def validate_query(query_url):
+    """
+    Returns the meta block of a query, from a short-lived cache keyed by the
+    canonical query when possible. Raises OpenAlexError, with the API's
+    response when there is one, if the query isn't valid.
+    """
+    key = json.dumps(canonical_query(query_url), sort_keys=True)
+    key = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    if cached := validation_cache.get(key):
+        return json.loads(cached)
+
+    response = web_openalex_client.get(validation_url(query_url))
+    if response.status_code != 200:
+        raise OpenAlexError(f'OpenAlex API returned {response.status_code}',
+                            response=response)
+    meta = (response.json() or {}).get('meta') or {}
+    if not meta.get('page'):
+        raise OpenAlexError(f'OpenAlex API returned no results page for {query_url}')
+
+    validation_cache.put(key, json.dumps(meta).encode('utf-8'))
+    return meta
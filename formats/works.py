@@ -0,0 +1,72 @@
+import re
+
+from app import openalex_api_key, work_cache_size, work_cache_ttl_seconds
+from formats.client import web_openalex_client, OpenAlexError
+from util import TtlLruCache
+
+WORKS_URL = 'https://api.openalex.org/works'
+# the most values OpenAlex accepts in one OR filter
+WORKS_PER_REQUEST = 100
+
+WORK_ID_PATTERN = re.compile(r'^(?:https?://(?:api\.)?openalex\.org/(?:works/)?)?(W\d+)$',
+                             re.IGNORECASE)
+
+# work JSON by short id, per web worker process
+work_cache = TtlLruCache(work_cache_size, work_cache_ttl_seconds)
+
+
+def normalize_work_id(work_id):
+    """'W123' for W123, w123 or an OpenAlex work URL, otherwise None."""
+    if match := WORK_ID_PATTERN.match(work_id.strip()):
+        return match.group(1).upper()
+    return None
+
+
+def fetch_works(work_ids, max_age=None):
+    """
+    Returns {work_id: work} for the given short ids, from the cache where
+    possible (and cached no more than max_age seconds ago, when given) and
+    otherwise in one openalex_id OR-filter request per WORKS_PER_REQUEST ids.
+    Ids OpenAlex doesn't return are left out.
+    """
+    works = {}
+    missing = []
+    for work_id in work_ids:
+        if (work := work_cache.get(work_id, max_age)) is not None:
+            works[work_id] = work
+        elif work_id not in missing:
+            missing.append(work_id)
+
+    for start in range(0, len(missing), WORKS_PER_REQUEST):
+        batch = missing[start:start + WORKS_PER_REQUEST]
+        response_json = web_openalex_client.get_json(WORKS_URL, params={
+            'filter': f'openalex_id:{"|".join(batch)}',
+            'per_page': len(batch),
+            'api-key': openalex_api_key,
+        })
+        for work in response_json.get('results', []):
+            if work_id := normalize_work_id(work.get('id') or ''):
+                work_cache.put(work_id, work)
+                works[work_id] = work
+    return works
+
+
+def fetch_work(work_id, max_age=None):
+    """
+    Returns a work by OpenAlex id, through the cache, or by any other id
+    /works/ accepts. Returns None when OpenAlex doesn't have it.
+    """
+    if short_id := normalize_work_id(work_id):
+        return fetch_works([short_id], max_age).get(short_id)
+
+    response = web_openalex_client.get(f'{WORKS_URL}/{work_id}',
+                                   params={'api-key': openalex_api_key})
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise OpenAlexError(f'OpenAlex API returned {response.status_code}',
+                            response=response)
+    work = response.json()
+    if short_id := normalize_work_id(work.get('id') or ''):
+        work_cache.put(short_id, work)
+    return work
@@ -1,10 +1,9 @@
 import datetime
-import tempfile
-from io import StringIO
 
 import pycountry
 
-from formats.util import paginate, get_first_page
+from formats.s3 import streaming_s3_key
+from formats.util import paginate, open_partial_output, output_location
 
 HEADER = [
     'FN OpenAlex',
@@ -12,44 +11,41 @@ HEADER = [
 ]
 
 
-def export_wos(export):
-    wos_filename = tempfile.mkstemp(suffix='.txt')[1]
-    with open(wos_filename, 'w') as file:
-        file.write('\n'.join(HEADER))
-        file.write('\n')
-        for page in paginate(export, wos_filename):
-            lines = []
-            for work in page:
-                for key, processor in WOS_PROCESSORS.items():
-                    line = processor(work)
-                    # stripe None values
-                    if line and line[0].split(' ')[1] == 'None':
-                        line[0] = line[0].split(' ')[0]
-                    lines.extend(line)
-                # write to file and add a blank line
-                file.write('\n'.join(lines))
-                file.write('\nER\n\n')
-
-    return wos_filename
-
-
-def instant_export(export):
-    first_page = get_first_page(export)
-    buffer = StringIO()
-    buffer.write('\n'.join(HEADER))
-    buffer.write('\n')
+def write_wos_header(file):
+    file.write('\n'.join(HEADER))
+    file.write('\n')
+
+
+def write_wos_page(file, page):
+    for entry in wos_entries(page):
+        file.write(entry)
+
+
+def wos_entries(page):
+    """The text written for each work of a page, in order."""
     lines = []
-    for work in first_page['results']:
+    for work in page:
         for key, processor in WOS_PROCESSORS.items():
             line = processor(work)
+            # stripe None values
             if line and line[0].split(' ')[1] == 'None':
                 line[0] = line[0].split(' ')[0]
             lines.extend(line)
         # write to file and add a blank line
-        buffer.write('\n'.join(lines))
-        buffer.write('\nER\n\n')
-        
-    return buffer.getvalue()
+        yield '\n'.join(lines) + '\nER\n\n'
+
+
+def export_wos(export):
+    file, resumed = open_partial_output(export, '.txt',
+                                        streaming_s3_key(export))
+    wos_filename = file.name
+    with file:
+        if not resumed:
+            write_wos_header(file)
+        for page in paginate(export, wos_filename, output=file):
+            write_wos_page(file, page)
+
+    return output_location(file)
 
 
 def process_pub_type(work):
@@ -1,29 +1,28 @@
-import io
 import tempfile
-import zipfile
+from functools import partial
 
-from formats.util import build_dataframes, join_lists
+from app import zip_compression_level, zip_compression_workers
+from formats.csv_stream import spooled_export, render_table
+from formats.zip_writer import MP_CONTEXT, write_zip
 
+# compression processes start with the renderer's imports (pandas, the app) done
+MP_CONTEXT.set_forkserver_preload(['formats.csv_stream'])
 
-def create_csv_zip_buffer(fnames_df_map):
-    zip_buffer = io.BytesIO()
 
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for name, df in fnames_df_map.items():
-            df = df.applymap(join_lists)
-            csv_buffer = io.StringIO()
-            fname = f'{name}.csv'
-            df.to_csv(csv_buffer, index=False)
-            zip_file.writestr(fname, csv_buffer.getvalue())
-
-    zip_buffer.seek(0)
-    return zip_buffer
+def export_zip(export):
+    with spooled_export(export) as (writer, spool_path):
+        return write_spooled_zip(export, writer, spool_path)
 
 
-def export_zip(export):
-    dfs = build_dataframes(export)
-    zip_buffer = create_csv_zip_buffer(dfs)
+def write_spooled_zip(export, writer, spool_path):
     zip_filename = tempfile.mkstemp(suffix='.zip')[1]
-    with open(zip_filename, 'wb') as zip_file:
-        zip_file.write(zip_buffer.getvalue())
+    # each table is rendered from the spool and compressed in its own process
+    state = writer.to_state()
+    members = [
+        (f'{name}.csv',
+         partial(render_table, dict(export.args), state, name, spool_path))
+        for name, _ in writer.tables()
+    ]
+    write_zip(zip_filename, members, zip_compression_level,
+              zip_compression_workers)
     return zip_filename
@@ -0,0 +1,163 @@
+import io
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_DEFLATED = 8
+UTF8_NAMES_FLAG = 0x800
+
+# the export worker has threads running by now, and a forked child can deadlock
+# on a lock (logging, boto3, psycopg2) one of them held
+MP_CONTEXT = multiprocessing.get_context('forkserver')
+
+DeflatedMember = namedtuple('DeflatedMember',
+                            ['name', 'path', 'crc', 'compressed_size', 'size'])
+
+
+class _DeflateWriter(io.RawIOBase):
+    """Binary sink that raw-deflates into a file, tracking CRC and sizes."""
+
+    def __init__(self, fileobj, level):
+        self.fileobj = fileobj
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self.crc = 0
+        self.size = 0
+        self.compressed_size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.crc = zlib.crc32(b, self.crc)
+        self.size += len(b)
+        self._write_compressed(self.compressor.compress(b))
+        return len(b)
+
+    def finish(self):
+        self._write_compressed(self.compressor.flush())
+
+    def _write_compressed(self, data):
+        self.compressed_size += len(data)
+        self.fileobj.write(data)
+
+
+def deflate_member(name, render, level, scratch_dir):
+    """
+    Calls render(text_file) and raw-deflates what it writes into a file in
+    scratch_dir. Runs in a worker process, so render must be picklable.
+    """
+    fd, path = tempfile.mkstemp(suffix='.deflate', dir=scratch_dir)
+    with os.fdopen(fd, 'wb') as f:
+        deflater = _DeflateWriter(f, level)
+        text_file = io.TextIOWrapper(io.BufferedWriter(deflater, 1 << 20),
+                                     encoding='utf-8', newline='')
+        render(text_file)
+        text_file.flush()
+        deflater.finish()
+        text_file.detach()
+    return DeflatedMember(name, path, deflater.crc, deflater.compressed_size,
+                          deflater.size)
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    dos_date = (t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    dos_time = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return dos_time, dos_date
+
+
+def _write_archive(zip_file, members):
+    dos_time, dos_date = _dos_datetime(time.time())
+    central_directory = []
+
+    for member in members:
+        offset = zip_file.tell()
+        name = member.name.encode('utf-8')
+        zip64 = member.size >= ZIP64_LIMIT or member.compressed_size >= ZIP64_LIMIT
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, member.size, member.compressed_size)
+            sizes = (ZIP64_LIMIT, ZIP64_LIMIT)
+        else:
+            extra = b''
+            sizes = (member.compressed_size, member.size)
+        version = 45 if zip64 else 20
+        zip_file.write(struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, version, UTF8_NAMES_FLAG,
+            ZIP_DEFLATED, dos_time, dos_date, member.crc, *sizes,
+            len(name), len(extra)))
+        zip_file.write(name)
+        zip_file.write(extra)
+        with open(member.path, 'rb') as f:
+            shutil.copyfileobj(f, zip_file, 1 << 20)
+        central_directory.append((member, name, offset))
+
+    cd_offset = zip_file.tell()
+    for member, name, offset in central_directory:
+        zip64_fields = []
+        size, compressed_size, header_offset = member.size, member.compressed_size, offset
+        if size >= ZIP64_LIMIT:
+            zip64_fields.append(size)
+            size = ZIP64_LIMIT
+        if compressed_size >= ZIP64_LIMIT:
+            zip64_fields.append(compressed_size)
+            compressed_size = ZIP64_LIMIT
+        if header_offset >= ZIP64_LIMIT:
+            zip64_fields.append(header_offset)
+            header_offset = ZIP64_LIMIT
+        extra = b''
+        if zip64_fields:
+            extra = struct.pack(f'<HH{len(zip64_fields)}Q', 1,
+                                8 * len(zip64_fields), *zip64_fields)
+        version = 45 if zip64_fields else 20
+        zip_file.write(struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, version, version,
+            UTF8_NAMES_FLAG, ZIP_DEFLATED, dos_time, dos_date, member.crc,
+            compressed_size, size, len(name), len(extra), 0, 0, 0,
+            0o644 << 16, header_offset))
+        zip_file.write(name)
+        zip_file.write(extra)
+    cd_end = zip_file.tell()
+
+    count = len(central_directory)
+    cd_size = cd_end - cd_offset
+    if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        zip_file.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                                   count, count, cd_size, cd_offset))
+        zip_file.write(struct.pack('<IIQI', 0x07064b50, 0, cd_end, 1))
+        count = min(count, 0xFFFF)
+        cd_size = min(cd_size, ZIP64_LIMIT)
+        cd_offset = min(cd_offset, ZIP64_LIMIT)
+    zip_file.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count,
+                               cd_size, cd_offset, 0))
+
+
+def write_zip(zip_filename, members, level=6, workers=1):
+    """
+    Writes a deflated ZIP of members, a list of (name, render) where
+    render(text_file) writes the member's text. Members are compressed in up
+    to workers processes, started from a fork server, and then copied into
+    the archive in order.
+    """
+    scratch_dir = tempfile.mkdtemp(prefix='zip-members-')
+    try:
+        if workers > 1 and len(members) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(members)),
+                                     mp_context=MP_CONTEXT) as pool:
+                futures = [pool.submit(deflate_member, name, render, level, scratch_dir)
+                           for name, render in members]
+                deflated = [future.result() for future in futures]
+        else:
+            deflated = [deflate_member(name, render, level, scratch_dir)
+                        for name, render in members]
+        with open(zip_filename, 'wb') as zip_file:
+            _write_archive(zip_file, deflated)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    return zip_filename
@@ -0,0 +1,74 @@
+import select
+import time
+
+from sqlalchemy import text
+
+from app import db, logger, EXPORT_TABLE
+
+# an export was submitted, for export_worker
+EXPORT_SUBMITTED_CHANNEL = f'{EXPORT_TABLE}_submitted'
+# an export finished or an email was requested, for email_worker
+EXPORT_FINISHED_CHANNEL = f'{EXPORT_TABLE}_finished'
+
+
+def notify(channel, payload=''):
+    """
+    Queues a NOTIFY on the session's transaction. Postgres only delivers it
+    when the transaction commits, so listeners never see uncommitted jobs.
+    """
+    db.session.execute(text('select pg_notify(:channel, :payload)'),
+                       {'channel': channel, 'payload': payload})
+
+
+class JobListener:
+    """
+    Holds a dedicated connection LISTENing on one or more channels, so a
+    worker can sleep until a job is announced instead of polling the job
+    table.
+    """
+
+    def __init__(self, *channels):
+        self.channels = channels
+        self.connection = None
+
+    def _connect(self):
+        # a raw DBAPI connection, outside the session and its transactions
+        connection = db.engine.raw_connection()
+        connection.set_isolation_level(0)  # autocommit
+        cursor = connection.cursor()
+        for channel in self.channels:
+            cursor.execute(f'LISTEN {channel}')
+        cursor.close()
+        self.connection = connection
+
+    def wait(self, timeout):
+        """
+        Blocks until a notification arrives or timeout seconds pass, and
+        returns whether one arrived. Notifications that queued up meanwhile are
+        drained, since one fetch query picks up any waiting job. If the
+        connection fails, waits out the timeout so polling takes over until it
+        can be reopened.
+        """
+        try:
+            if self.connection is None:
+                self._connect()
+            driver_connection = self.connection.connection
+            if not driver_connection.notifies:
+                select.select([driver_connection], [], [], timeout)
+                driver_connection.poll()
+            notified = bool(driver_connection.notifies)
+            driver_connection.notifies.clear()
+            return notified
+        except Exception as e:
+            logger.warning(f'lost LISTEN connection for {", ".join(self.channels)}: {e}')
+            self.close()
+            time.sleep(timeout)
+            return False
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
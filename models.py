@@ -18,6 +18,9 @@ class Export(db.Model):
     status = db.Column(db.Text)
     format = db.Column(db.Text)
     status = db.Column(db.Text)
+    # every format of a multi-format export in request order, e.g. ['csv', 'ris'],
+    # where format is the first; NULL (not JSON null) for single-format exports
+    format_list = db.Column(JSONB(none_as_null=True))
     progress = db.Column(db.Float)
     result_url = db.Column(db.Text)
     submitted = db.Column(db.DateTime)
@@ -27,6 +30,14 @@ class Export(db.Model):
     select = db.Column(db.Text)
     columns = db.Column(db.Text)
     args = db.Column(JSONB)
+    # formats.fingerprint.query_fingerprint of query_url and args, for reuse
+    fingerprint = db.Column(db.Text, index=True)
+    # meta.count from the validation request, for picking a queue lane
+    result_count = db.Column(db.Integer)
+    # {format: {'key', 'size', 'content_type'}} of each uploaded S3 object
+    outputs = db.Column(JSONB)
+    # cursors and partial output location saved by paginate, for resuming
+    checkpoint = db.Column(JSONB(none_as_null=True))
 
     def __init__(self, **kwargs):
         if 'format' in kwargs:
@@ -37,12 +48,16 @@ class Export(db.Model):
         self.progress_updated = self.submitted
         super().__init__(**kwargs)
 
+    @property
+    def formats(self):
+        return self.format_list or [self.format]
+
     @property
     def progress_url(self):
         return f'{app_url}/export/{self.id}'
 
     def to_dict(self):
-        return {
+        result = {
             'id': self.id,
             'query_url': self.query_url,
             'status': self.status,
@@ -53,6 +68,12 @@ class Export(db.Model):
             'progress_updated': self.progress_updated and self.progress_updated.isoformat(),
             'progress_url': self.progress_url
         }
+        if len(self.formats) > 1:
+            result['formats'] = self.formats
+        if len(self.formats) > 1 and self.result_url:
+            result['result_urls'] = {f: f'{self.result_url}?format={f}'
+                                     for f in self.formats}
+        return result
 
     def __repr__(self):
         return f'<Export ({self.id}, {self.query_url}, {self.status})>'
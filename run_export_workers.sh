@@ -1,9 +1,16 @@
+default_lane=${EXPORT_WORKER_LANE:-any}
 for (( i=1; i<=$EXPORT_WORKERS_PER_DYNO; i++ ))
 do
 #   COMMAND="python queue_pub.py --run --name=run-$DYNO:${i} "
   COMMAND="python export_worker.py"
-  echo $COMMAND
+  # the first EXPORT_SMALL_LANE_WORKERS workers only take small exports
+  if (( i <= ${EXPORT_SMALL_LANE_WORKERS:-0} )); then
+    export EXPORT_WORKER_LANE=small
+  else
+    export EXPORT_WORKER_LANE=$default_lane
+  fi
+  echo "$COMMAND (lane: $EXPORT_WORKER_LANE)"
   $COMMAND&
 done
 trap "kill 0" INT TERM EXIT
-wait
\ No newline at end of file
+wait
@@ -1,5 +1,42 @@
+import threading
 import time
+from collections import OrderedDict
 
 
 def elapsed(since, round_places=2):
-    return round(time.time() - since, round_places)
\ No newline at end of file
+    return round(time.time() - since, round_places)
+
+
+class TtlLruCache:
+    """A small thread-safe in-memory cache with LRU eviction and a TTL."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, max_age=None):
+        """The value for key, or None when missing, expired or older than max_age."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            age = time.time() - stored_at
+            if age > self.ttl:
+                del self._entries[key]
+                return None
+            if max_age is not None and age > max_age:
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
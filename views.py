@@ -4,20 +4,30 @@ import os
 import re
 from urllib.parse import urlencode
 
-import boto3
 import requests
 import shortuuid
-from flask import abort, jsonify, make_response, redirect, request
+from flask import abort, jsonify, make_response, redirect, request, Response
 import sentry_sdk
+from sqlalchemy import and_, or_, text
 
 from app import app, supported_formats, s3_key_formats, logger
-from app import db
+from app import db, export_reuse_minutes, export_stale_minutes, \
+    bibtex_batch_max_ids, single_work_max_age_seconds
 from bibtex import dump_bibtex
-from formats.util import parse_bool
+from formats.client import OpenAlexError
+from formats.fingerprint import query_fingerprint
+from formats.multi import MULTI_FORMATS
+from formats.util import parse_bool, get_first_page
+from formats.s3 import EXPORT_BUCKET, EXPORT_CONTENT_TYPES, get_s3_client, \
+    presigned_download_url
+from formats.validation import validate_query
+from formats.works import WORKS_PER_REQUEST, fetch_work, fetch_works, \
+    normalize_work_id
+from job_events import EXPORT_FINISHED_CHANNEL, EXPORT_SUBMITTED_CHANNEL, notify
 from models import Export, ExportEmail
-from formats.csv import instant_export as csv_instant_export
-from formats.ris import instant_export as ris_instant_export
-from formats.wos_plaintext import instant_export as wos_instant_export
+from formats.instant import CONTENT_TYPES as INSTANT_CONTENT_TYPES, \
+    cache_as_rendered, instant_cache, instant_export_key, render_chunks, \
+    works_etag
 
 sentry_sdk.init(dsn=os.environ.get('SENTRY_DSN'), )
 
@@ -54,22 +64,38 @@ def after_request(response):
 
 
 def instant_export_response(export):
-    if export.format == "csv":
-        file_str = csv_instant_export(export)
-        content_type = 'text/csv'
-    elif export.format == "ris":
-        file_str = ris_instant_export(export)
-        content_type = 'text/x-ris'
-    elif export.format == "wos-plaintext":
-        file_str = wos_instant_export(export)
-        content_type = 'text/x-wos'
-    else:
+    """
+    The first page of an export's results, rendered from the in-memory cache
+    when the same query and format was rendered recently, and otherwise
+    streamed as it is rendered.
+    """
+    if export.format not in INSTANT_CONTENT_TYPES:
         raise Exception('Invalid export format: {}'.format(export.format))
-    output = make_response(file_str)
+
+    key = instant_export_key(export)
+    if cached := instant_cache.get(key):
+        etag, body = cached
+        output = make_response(body)
+    else:
+        try:
+            works = get_first_page(export)['results']
+        except OpenAlexError as e:
+            # not retried, so the user can try again rather than wait on a busy API
+            if e.response is not None:
+                return make_response(e.response.content, e.response.status_code)
+            abort_json(500, f"There was an error fetching results for {export.query_url}.")
+        except requests.exceptions.RequestException:
+            abort_json(500, f"There was an error fetching results for {export.query_url}.")
+        etag = works_etag(key, works)
+        # the body is streamed after this request's session is gone
+        chunks = render_chunks(export.format, dict(export.args), works)
+        output = Response(cache_as_rendered(key, etag, chunks))
+
     output.headers[
         "Content-Disposition"] = f"attachment; filename={export.id}.{export.format}"
-    output.headers["Content-type"] = content_type
-    return output
+    output.headers["Content-type"] = INSTANT_CONTENT_TYPES[export.format]
+    output.set_etag(etag)
+    return output.make_conditional(request)
 
 
 @app.route('/works', strict_slashes=False, methods=["GET"])
@@ -87,7 +113,21 @@ def init_export_works():
     if not export_format:
         abort_json(400, '"format" argument is required')
 
-    if export_format in supported_formats:
+    # several formats, e.g. "csv,ris", are rendered from one pass over the results
+    export_formats = list(dict.fromkeys(
+        f.strip() for f in export_format.split(',') if f.strip()))
+    if not export_formats:
+        abort_json(400, '"format" argument is required')
+    # the first is the export's format, and what its download defaults to
+    export_format = export_formats[0]
+    if len(export_formats) > 1:
+        if unsupported := set(export_formats) - MULTI_FORMATS:
+            abort_json(422,
+                       f'formats {",".join(sorted(unsupported))} can\'t be combined, combinable formats are: {",".join(sorted(MULTI_FORMATS))}')
+        if not parse_bool(request.args.get('async', 'true')):
+            abort_json(422, 'several formats can only be exported with async=true')
+
+    if all(f in supported_formats for f in export_formats):
         query_url = 'https://api.openalex.org/works'
         query_args = {}
 
@@ -127,29 +167,26 @@ def init_export_works():
             query_string = urlencode(query_args)
             query_url = f'{query_url}?{query_string}'
 
-        # Query for existing export
-        export = Export.query.filter(
-            Export.format == export_format,
-            Export.query_url == query_url,
-            Export.args == export_args,  # JSON comparison
-            Export.progress_updated > datetime.datetime.utcnow() - datetime.timedelta(
-                minutes=15)
-        ).first()
+        fingerprint = query_fingerprint(query_url, export_args)
+        # identical requests wait here for each other until commit, so only
+        # the first creates an export
+        db.session.execute(text('select pg_advisory_xact_lock(hashtext(:fingerprint))'),
+                           {'fingerprint': fingerprint})
+        export = find_reusable_export(fingerprint, export_formats)
 
         if not export:
-            if export_format != 'group-bys-csv':
+            # another format of the same query already validated it
+            result_count = find_result_count(fingerprint)
+            if export_format != 'group-bys-csv' and result_count is None:
                 try:
-                    test_query_response = requests.get(query_url)
+                    result_count = validate_query(query_url).get('count')
 
-                    if not test_query_response.status_code == 200:
-                        return make_response(test_query_response.content,
-                                             test_query_response.status_code)
-
-                    if not (response_json := test_query_response.json()):
-                        raise requests.exceptions.RequestException
-
-                    if not response_json.get('meta', {}).get('page'):
-                        raise requests.exceptions.RequestException
+                except OpenAlexError as e:
+                    if e.response is not None:
+                        return make_response(e.response.content,
+                                             e.response.status_code)
+                    abort_json(500,
+                               f"There was an error submitting your request to {query_url}.")
 
                 except requests.exceptions.RequestException:
                     abort_json(500,
@@ -157,12 +194,16 @@ def init_export_works():
 
             # Create new export with args as JSON
             export = Export(
-                id=f'works-{export_format}-{shortuuid.uuid()}',
+                id=f'works-{"-".join(export_formats)}-{shortuuid.uuid()}',
                 query_url=query_url,
                 format=export_format,
-                args=export_args
+                format_list=export_formats if len(export_formats) > 1 else None,
+                args=export_args,
+                fingerprint=fingerprint,
+                result_count=result_count
             )
             db.session.merge(export)
+            notify(EXPORT_SUBMITTED_CHANNEL, export.id)
 
         if email:
             export_email = ExportEmail(
@@ -170,6 +211,8 @@ def init_export_works():
                 requester_email=email
             )
             db.session.merge(export_email)
+            # the export may already be finished
+            notify(EXPORT_FINISHED_CHANNEL, export.id)
 
         db.session.commit()
 
@@ -182,6 +225,37 @@ def init_export_works():
                    f'supported formats are: {",".join(supported_formats.keys())}')
 
 
+def find_reusable_export(fingerprint, export_formats):
+    """
+    An export of the same canonical query and formats that is still queued or
+    running, or that finished within export_reuse_minutes.
+    """
+    now = datetime.datetime.utcnow()
+    return Export.query.filter(
+        Export.fingerprint == fingerprint,
+        Export.format == export_formats[0],
+        (Export.format_list == export_formats) if len(export_formats) > 1
+        else Export.format_list.is_(None),
+        or_(
+            Export.status == 'submitted',
+            and_(Export.status == 'running',
+                 Export.progress_updated > now - datetime.timedelta(minutes=export_stale_minutes)),
+            and_(Export.status == 'finished',
+                 Export.progress_updated > now - datetime.timedelta(minutes=export_reuse_minutes)),
+        )
+    ).order_by(Export.submitted.desc()).first()
+
+
+def find_result_count(fingerprint):
+    """The result count of a recent export of the query in any format."""
+    export = Export.query.filter(
+        Export.fingerprint == fingerprint,
+        Export.result_count.isnot(None),
+        Export.submitted > datetime.datetime.utcnow() - datetime.timedelta(minutes=export_reuse_minutes)
+    ).order_by(Export.submitted.desc()).first()
+    return export and export.result_count
+
+
 @app.route('/export/<export_id>', methods=["GET"])
 def lookup_export(export_id):
     if not (export := Export.query.get(export_id)):
@@ -195,15 +269,27 @@ def download_export(export_id):
     if not (export := Export.query.get(export_id)):
         abort_json(404, f'Export {export_id} does not exist.')
 
-    if export.format not in supported_formats:
+    if not all(f in supported_formats for f in export.formats):
         abort_json(422, f'Export {export_id} is not a supported format.')
 
     if not export.status == 'finished':
         abort_json(422, f'Export {export_id} is not finished.')
 
-    s3_client = boto3.client('s3')
-    obj = s3_client.list_objects(Bucket='openalex-query-exports', Prefix=export_id)['Contents'][0]
-    extension = obj['Key'].split('.')[-1]
+    # a multi-format export has one object per format, the first by default
+    download_format = request.args.get('format', export.formats[0])
+    if download_format not in export.formats:
+        abort_json(404, f'Export {export_id} has no {download_format} output.')
+
+    if output := (export.outputs or {}).get(download_format):
+        key, content_type = output['key'], output['content_type']
+    else:
+        # exports finished before the worker recorded their object keys
+        prefix = export_id
+        if len(export.formats) > 1:
+            prefix = f'{export_id}.{supported_formats[download_format]}'
+        key = get_s3_client().list_objects(Bucket=EXPORT_BUCKET, Prefix=prefix)['Contents'][0]['Key']
+        content_type = EXPORT_CONTENT_TYPES.get(download_format, 'text/csv')
+    extension = key.split('.')[-1]
     extension = extension if '00' not in extension else 'csv'
 
     if export.submitted:
@@ -212,49 +298,103 @@ def download_export(export_id):
     else:
         filename = f'{export_id}.{extension}'
 
-    presigned_url = s3_client.generate_presigned_url(
-        'get_object',
-        Params={
-            'Bucket': 'openalex-query-exports',
-            'Key': obj['Key'],
-            'ResponseContentDisposition': f'attachment; filename={filename}',
-            'ResponseContentType': 'text/csv'
-        },
-        ExpiresIn=300
-    )
+    presigned_url = presigned_download_url(key, filename, content_type)
 
     return redirect(presigned_url, 302)
 
 
+# extensions of the single-work endpoint and the formats they render
+SINGLE_WORK_FORMATS = {'bib': 'bib', 'ris': 'ris', 'txt': 'wos-plaintext',
+                       'csv': 'csv'}
+
+
 @app.route('/works/<work_id>.<export_format>', strict_slashes=False,
            methods=["GET"])
 def format_single_work(work_id, export_format):
+    """
+    One work in any of SINGLE_WORK_FORMATS. The work comes from the work
+    cache when it was fetched in the last single_work_max_age_seconds, and
+    the response has an ETag of the work's JSON (updated_date included) so
+    clients can revalidate it with If-None-Match.
+    """
     export_format = export_format and export_format.strip().lower()
 
     if not export_format:
         abort_json(400, '"format" argument is required')
-    if export_format == 'bib':
-        query_url = f'https://api.openalex.org/works/{work_id}'
-        response_json = {}
-
-        try:
-            query_response = requests.get(query_url)
-
-            if not query_response.status_code == 200:
-                return make_response(query_response.content,
-                                     query_response.status_code)
-
-            if not (response_json := query_response.json()):
-                raise requests.exceptions.RequestException
-        except requests.exceptions.RequestException:
-            abort_json(500,
-                       f"There was an error submitting your request to {query_url}.")
-
-        response = make_response(dump_bibtex(response_json))
-        response.headers['Content-Type'] = 'application/x-bibtex; charset=utf-8'
-        return response
-    else:
-        abort_json(422, 'supported formats are: "bib"')
+    if export_format not in SINGLE_WORK_FORMATS:
+        formats = ', '.join(f'"{f}"' for f in SINGLE_WORK_FORMATS)
+        abort_json(422, f'supported formats are: {formats}')
+
+    try:
+        work = fetch_work(work_id, max_age=single_work_max_age_seconds)
+    except OpenAlexError as e:
+        if e.response is not None:
+            return make_response(e.response.content, e.response.status_code)
+        abort_json(500, f"There was an error fetching work {work_id}.")
+    except requests.exceptions.RequestException:
+        abort_json(500, f"There was an error fetching work {work_id}.")
+
+    if not work:
+        abort_json(404, f'Work {work_id} does not exist.')
+
+    render_format = SINGLE_WORK_FORMATS[export_format]
+    body = ''.join(render_chunks(render_format, {}, [work]))
+    if not body:
+        abort_json(422, f'Work {work_id} has no {export_format} representation.')
+
+    response = make_response(body)
+    response.headers['Content-Type'] = INSTANT_CONTENT_TYPES[render_format]
+    response.set_etag(works_etag(render_format, [work]))
+    return response.make_conditional(request)
+
+
+def request_work_ids():
+    """Ids from a JSON body (a list, or {"ids": [...]}) or an "ids" argument."""
+    if request.is_json:
+        body = request.get_json(silent=True)
+        ids = body.get('ids') if isinstance(body, dict) else body
+        return [str(i) for i in ids] if isinstance(ids, list) else []
+    ids = request.values.get('ids', '')
+    return [i for i in re.split(r'[,|\s]+', ids) if i]
+
+
+@app.route('/works.bib', strict_slashes=False, methods=["GET", "POST"])
+def format_works_bibtex():
+    """
+    BibTeX for many works in one request, streamed in the order the ids were
+    given. Works are fetched WORKS_PER_REQUEST at a time with an openalex_id
+    OR-filter, and recently fetched works come from the work cache.
+    """
+    raw_ids = request_work_ids()
+    if not raw_ids:
+        abort_json(400, '"ids" argument is required')
+    if len(raw_ids) > bibtex_batch_max_ids:
+        abort_json(400, f'at most {bibtex_batch_max_ids} ids can be requested at once')
+
+    work_ids = [normalize_work_id(i) for i in raw_ids]
+    if invalid := [raw for raw, work_id in zip(raw_ids, work_ids) if not work_id]:
+        abort_json(400, f'not OpenAlex work ids: {", ".join(invalid[:10])}')
+
+    groups = [work_ids[i:i + WORKS_PER_REQUEST]
+              for i in range(0, len(work_ids), WORKS_PER_REQUEST)]
+    try:
+        # errors in the first group can still be reported with a status code
+        first_works = fetch_works(groups[0])
+    except requests.exceptions.RequestException:
+        abort_json(500, 'There was an error fetching works from OpenAlex.')
+
+    def entries():
+        works = first_works
+        for i, group in enumerate(groups):
+            if i:
+                works = fetch_works(group)
+            for work_id in group:
+                if (work := works.get(work_id)) and (entry := dump_bibtex(work)):
+                    yield entry
+
+    response = Response(entries())
+    response.headers['Content-Type'] = 'application/x-bibtex; charset=utf-8'
+    return response
 
 
 @app.route('/', methods=["GET", "POST"])